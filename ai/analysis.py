@@ -1,7 +1,9 @@
 # ai/analysis.py
 from __future__ import annotations
-from typing import Optional
+from typing import Iterator, List, Optional
 import os
+import httpx
+import numpy as np
 import pandas as pd
 import streamlit as st
 from openai import AzureOpenAI
@@ -18,8 +20,8 @@ Rules:
 
 def _get_azure_openai_client() -> AzureOpenAI:
     """
-    Create an Azure OpenAI client using the same env/secret pattern
-    as the Canvas rewriter app.
+    Return the (cached) Azure OpenAI client using the same env/secret pattern
+    as the Canvas rewriter app. Secrets are re-read on every call.
 
     Required (Streamlit secrets OR environment variables):
       - AZURE_OPENAI_ENDPOINT
@@ -49,67 +51,98 @@ def _get_azure_openai_client() -> AzureOpenAI:
             "in Streamlit secrets or environment."
         )
 
+    return _build_azure_openai_client(endpoint, api_key, api_version)
+
+@st.cache_resource(show_spinner=False)
+def _build_azure_openai_client(endpoint: str, api_key: str, api_version: str) -> AzureOpenAI:
+    """
+    One client per (endpoint, key, version), shared across reruns and sessions
+    so its keep-alive connection pool (and TLS session) is reused. Rotating a
+    secret changes the arguments and therefore builds a fresh client.
+    """
     return AzureOpenAI(
         azure_endpoint=endpoint,
         api_key=api_key,
         api_version=api_version,
+        http_client=httpx.Client(
+            timeout=60.0,
+            limits=httpx.Limits(max_keepalive_connections=8),
+        ),
     )
 
-def _df_to_markdown(df: Optional[pd.DataFrame], max_rows: int = 30) -> str:
+# Short, still-readable aliases for the long dashboard headers (fewer input tokens)
+_COLUMN_ALIASES = {
+    "Average View %": "Avg View %",
+    "# of Students Viewing": "Avg Viewers",
+    "# of Students": "Students",
+    "Avg % Turned In": "Turned In %",
+    "Avg Average Excluding Zeros": "Avg Excl Zeros %",
+    "n_assignments": "Assignments",
+}
+
+def _df_to_compact(df: Optional[pd.DataFrame], max_rows: int = 30, index: bool = False) -> str:
+    """Render a table as terse CSV for the prompt (far fewer tokens than a markdown grid); "" if empty."""
     if df is None or df.empty:
-        return "(empty)"
-    df2 = df.copy().head(max_rows)
-    # round percentage-like columns if any are numeric fractions
-    for c in df2.columns:
-        if df2[c].dtype.kind in "fc":
-            # if it looks like a fraction, render as %
-            if df2[c].between(0, 1, inclusive="both").mean() > 0.6:
-                df2[c] = (df2[c] * 100).round(1).astype(str) + "%"
-    return df2.to_markdown(index=False)
-
-def generate_analysis(
+        return ""
+    df2 = df.head(max_rows).dropna(axis=1, how="all")
+    # render fraction-like float columns as % in one block assignment
+    num = df2.select_dtypes(include="float")
+    pct_cols = num.columns[((num >= 0) & (num <= 1)).mean() > 0.6]
+    if len(pct_cols):
+        df2[pct_cols] = (num[pct_cols] * 100).round(1).astype(str) + "%"
+    df2 = df2.round(3).rename(columns=_COLUMN_ALIASES)
+    return df2.to_csv(index=index, lineterminator="\n").strip()
+
+def _build_payload(
     kpis: dict,
     echo_module_df: Optional[pd.DataFrame],
     gradebook_module_df: Optional[pd.DataFrame],
     gradebook_summary_df: Optional[pd.DataFrame],
-    model: str = "gpt-4o-mini",
-    temperature: float = 0.3,
 ) -> str:
     # Build a compact, de-identified payload
-    kpi_lines = []
-    for k, v in (kpis or {}).items():
-        if v is None: continue
-        if isinstance(v, float) and 0 <= v <= 1:
-            kpi_lines.append(f"- {k}: {v*100:.1f}%")
-        else:
-            kpi_lines.append(f"- {k}: {v}")
-
-    payload = f"""
-Data for analysis (de-identified):
-
-# KPIs
-{os.linesep.join(kpi_lines) if kpi_lines else "(none)"}
-
-# Echo Module Metrics (per-module)
-{_df_to_markdown(echo_module_df)}
-
-# Gradebook Summary Rows
-{_df_to_markdown(gradebook_summary_df)}
-
-# Gradebook Module Metrics (per-module)
-{_df_to_markdown(gradebook_module_df)}
+    kpi = pd.Series({k: v for k, v in (kpis or {}).items() if v is not None}, dtype=object)
+    num = pd.to_numeric(kpi, errors="coerce")
+    # floats in [0, 1] are fractions -> render as %; everything else verbatim
+    is_frac = kpi.map(lambda v: isinstance(v, float)).astype(bool) & num.between(0, 1)
+    formatted = np.where(is_frac, (num * 100).map("{:.1f}%".format), kpi.astype(str))
+    kpi_lines = [f"- {k}: {v}" for k, v in zip(kpi.index, formatted)]
+
+    # Only send sections that actually carry data; empty headers are wasted tokens
+    sections: List[tuple[str, str]] = []
+    if kpi_lines:
+        sections.append(("# KPIs", "\n".join(kpi_lines)))
+    for header, table in (
+        ("# Echo Module Metrics (per-module)", _df_to_compact(echo_module_df)),
+        ("# Gradebook Summary Rows", _df_to_compact(gradebook_summary_df, index=True)),
+        ("# Gradebook Module Metrics (per-module)", _df_to_compact(gradebook_module_df)),
+    ):
+        if table:
+            sections.append((header, table))
+    if not sections:
+        raise ValueError("No data to analyze")
+
+    body = "\n\n".join(f"{header}\n{text}" for header, text in sections)
+    return f"""
+Data for analysis (de-identified, CSV tables):
+
+{body}
 
 Instructions:
-- Be specific: cite modules and metrics with percentages/counts.
-- Call out trends and outliers.
-- Focus on descriptions of the data.
-- identify general trends and data points worthy of further investigation.
+- Identify general trends and data points worthy of further investigation.
 - No need to list each section of the course individually. Simply call out aspects of the data that seem important for further investigation.
 """
-    
-    # build payload above as you already do...
 
-    client = _get_azure_openai_client()
+
+def _chat_request(
+    kpis: dict,
+    echo_module_df: Optional[pd.DataFrame],
+    gradebook_module_df: Optional[pd.DataFrame],
+    gradebook_summary_df: Optional[pd.DataFrame],
+    model: str,
+    temperature: float,
+) -> dict:
+    """Keyword arguments shared by every chat.completions.create call."""
+    payload = _build_payload(kpis, echo_module_df, gradebook_module_df, gradebook_summary_df)
 
     # Prefer a global deployment name, but allow overriding via the `model` arg
     deployment_name = (
@@ -118,7 +151,7 @@ Instructions:
         or model  # fallback so you can pass a deployment name via `model`
     )
 
-    resp = client.chat.completions.create(
+    return dict(
         model=deployment_name,  # this is the Azure *deployment* name
         temperature=temperature,
         messages=[
@@ -126,4 +159,72 @@ Instructions:
             {"role": "user", "content": payload},
         ],
     )
-    return (resp.choices[0].message.content or "").strip()
+
+
+def generate_analysis_stream(
+    kpis: dict,
+    echo_module_df: Optional[pd.DataFrame],
+    gradebook_module_df: Optional[pd.DataFrame],
+    gradebook_summary_df: Optional[pd.DataFrame],
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.3,
+) -> Iterator[str]:
+    """Yield the analysis text chunk by chunk as Azure OpenAI streams it back."""
+    request = _chat_request(
+        kpis, echo_module_df, gradebook_module_df, gradebook_summary_df, model, temperature
+    )
+    client = _get_azure_openai_client()
+
+    stream = client.chat.completions.create(**request, stream=True)
+    for chunk in stream:
+        # Azure sends a leading chunk with no choices (content-filter results)
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+
+def generate_analysis_variants(
+    kpis: dict,
+    echo_module_df: Optional[pd.DataFrame],
+    gradebook_module_df: Optional[pd.DataFrame],
+    gradebook_summary_df: Optional[pd.DataFrame],
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.3,
+    n: int = 2,
+) -> List[str]:
+    """
+    Return `n` alternative analyses from a single request (`n=` completions),
+    so the prompt is sent and billed once rather than once per variant.
+    """
+    request = _chat_request(
+        kpis, echo_module_df, gradebook_module_df, gradebook_summary_df, model, temperature
+    )
+    client = _get_azure_openai_client()
+
+    resp = client.chat.completions.create(**request, n=n)
+    choices = sorted(resp.choices, key=lambda c: c.index)
+    return [(c.message.content or "").strip() for c in choices]
+
+
+def generate_analysis(
+    kpis: dict,
+    echo_module_df: Optional[pd.DataFrame],
+    gradebook_module_df: Optional[pd.DataFrame],
+    gradebook_summary_df: Optional[pd.DataFrame],
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.3,
+) -> str:
+    """Non-streaming convenience wrapper: return the full analysis as one string."""
+    parts = list(
+        generate_analysis_stream(
+            kpis=kpis,
+            echo_module_df=echo_module_df,
+            gradebook_module_df=gradebook_module_df,
+            gradebook_summary_df=gradebook_summary_df,
+            model=model,
+            temperature=temperature,
+        )
+    )
+    return "".join(parts).strip()
@@ -1,8 +1,13 @@
-from collections.abc import Iterator, Mapping
-from contextlib import contextmanager
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import Optional
+import atexit
+import hashlib
 
+import numpy as np
 import pandas as pd
+import plotly.graph_objects as go
 import streamlit as st
 
 from services.canvas import CanvasService
@@ -12,7 +17,7 @@ from processors.grades_adapter import GradebookTables, build_gradebook_tables
 from ui.charts import chart_gradebook_combo, chart_echo_combo
 from ui.helptext import HELP
 from ui.kpis import compute_kpis
-from ai.analysis import generate_analysis
+from ai.analysis import generate_analysis_stream, generate_analysis_variants
 import os
 
 st.set_page_config(page_title="Canvas/Echo Dashboard", layout="wide")
@@ -28,34 +33,25 @@ hero(
 # Centering toggle (wizard only)
 _CSS_SLOT = st.empty()
 
+_WIZARD_CENTER_CSS = """
+<style>
+/* Make the main content fill the viewport and center it vertically */
+section.main > div.block-container{
+  min-height: 85vh;              /* enough height to center without clipping */
+  display: flex;
+  flex-direction: column;
+  justify-content: center;       /* vertical centering */
+}
+</style>
+"""
+
 def _set_wizard_center(on: bool):
+    # Streamlit drops slots that a rerun leaves unwritten, which also removes the
+    # <style> tag, so the dashboard needs no "reset" CSS sent on every rerun.
     if on:
-        _CSS_SLOT.markdown(
-            """
-            <style>
-            /* Make the main content fill the viewport and center it vertically */
-            section.main > div.block-container{
-              min-height: 85vh;              /* enough height to center without clipping */
-              display: flex;
-              flex-direction: column;
-              justify-content: center;       /* vertical centering */
-            }
-            </style>
-            """,
-            unsafe_allow_html=True,
-        )
+        _CSS_SLOT.markdown(_WIZARD_CENTER_CSS, unsafe_allow_html=True)
     else:
-        _CSS_SLOT.markdown(
-            """
-            <style>
-            section.main > div.block-container{
-              min-height: auto;
-              display: block;
-            }
-            </style>
-            """,
-            unsafe_allow_html=True,
-        )
+        _CSS_SLOT.empty()
 
 NOTICE = "No identifying information will be present in this analysis. All data will be de-identified."
 DEFAULT_BASE_URL = st.secrets.get("CANVAS_BASE_URL", "https://colostate.instructure.com")
@@ -91,45 +87,131 @@ def step_header(step: int, title: str, subtitle: str | None = None, emoji: str |
         unsafe_allow_html=True,
     )
 
-# ---------------- Caching helpers ----------------
-@contextmanager
-def get_canvas_service(base_url: str, token: str) -> Iterator[CanvasService]:
+# ---------------- Caching helpers ----------------
+# Services (and their pooled HTTP clients) live for the whole process so later
+# fetches reuse warm keep-alive connections instead of re-doing TLS handshakes.
+@st.cache_resource(show_spinner=False)
+def get_canvas_service(base_url: str, token: str) -> CanvasService:
     svc = CanvasService(base_url, token)
-    try:
-        yield svc
-    finally:
-        svc.close()
+    atexit.register(svc.close)
+    return svc
 
-@contextmanager
-def get_echo_service(base_url: str, token: str) -> Iterator[Echo360Service]:
+@st.cache_resource(show_spinner=False)
+def get_echo_service(base_url: str, token: str) -> Echo360Service:
     svc = Echo360Service(base_url, token)
-    try:
-        yield svc
-    finally:
-        svc.close()
+    atexit.register(svc.close)
+    return svc
 
 
-def load_canvas_data(base_url: str, token: str, course_id: str) -> tuple[pd.DataFrame, GradebookTables, Optional[int]]:
-    with get_canvas_service(base_url, token) as svc:
-        course_id_int = int(course_id)
-        canvas_df = svc.build_order_df(course_id_int)
-        gradebook_df = svc.build_gradebook_dataframe(course_id_int)
-        student_count = svc.get_student_count(course_id_int)
+def _token_hash(token: str) -> str:
+    """Stable, non-reversible stand-in for a secret so it can key a cache entry."""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _hash_dataframe(df: pd.DataFrame) -> int:
+    """Content hash of a frame; computed once per fetched frame and stashed in session state."""
+    # Headers and dtypes are part of the key (same values under other columns, or two empty frames,
+    # must not collide); row hashes go in as ordered bytes rather than an order-blind sum
+    h = hashlib.blake2b(digest_size=8)
+    h.update(repr((tuple(df.columns), tuple(map(str, df.dtypes)))).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return int.from_bytes(h.digest(), "little")
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _load_canvas_data_cached(
+    base_url: str,
+    token_hash: str,
+    course_id: str,
+    _token: str,
+) -> tuple[pd.DataFrame, GradebookTables, Optional[int]]:
+    # `_token` is excluded from the cache key; `token_hash` stands in for it.
+    course_id_int = int(course_id)
+    svc = get_canvas_service(base_url, _token)
+    # The three builders hit independent Canvas endpoints; fan them out so
+    # wall time tracks the slowest call instead of the sum of all three.
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        order_future = pool.submit(svc.build_order_df, course_id_int)
+        gradebook_future = pool.submit(svc.build_gradebook_dataframe, course_id_int)
+        count_future = pool.submit(svc.get_student_count, course_id_int)
+        canvas_df = order_future.result()
+        gradebook_df = gradebook_future.result()
+        student_count = count_future.result()
     gradebook_tables = build_gradebook_tables(gradebook_df, canvas_df)
     return canvas_df, gradebook_tables, student_count
 
 
+def load_canvas_data(base_url: str, token: str, course_id: str) -> tuple[pd.DataFrame, GradebookTables, Optional[int]]:
+    return _load_canvas_data_cached(base_url, _token_hash(token), course_id, token)
+
+
+# Frames are passed as `_df` (excluded from hashing) next to their precomputed
+# content hash, so each frame is hashed once rather than once per cache lookup.
+@st.cache_data(ttl=3600, show_spinner=False)
+def _load_echo_tables_cached(
+    base_url: str,
+    token_hash: str,
+    section_id: str,
+    canvas_hash: int,
+    _canvas_df: pd.DataFrame,
+    students_total: Optional[int],
+    _token: str,
+) -> EchoTables:
+    echo_df = get_echo_service(base_url, _token).build_engagement_dataframe(section_id)
+    return build_echo_tables(echo_df, _canvas_df, class_total_students=students_total)
+
+
 def load_echo_tables(
     base_url: str,
     token: str,
     section_id: str,
     canvas_df: pd.DataFrame,
     students_total: Optional[int],
+    canvas_hash: Optional[int] = None,
  ) -> EchoTables:
-    with get_echo_service(base_url, token) as svc:
-        echo_df = svc.build_engagement_dataframe(section_id)
-    return build_echo_tables(echo_df, canvas_df, class_total_students=students_total)
-
+    if canvas_hash is None:
+        canvas_hash = _hash_dataframe(canvas_df)
+    return _load_echo_tables_cached(
+        base_url, _token_hash(token), section_id, canvas_hash, canvas_df, students_total, token
+    )
+
+@st.cache_data(show_spinner=False)
+def _cached_gradebook_chart(df_hash: int, _df: pd.DataFrame, title: str) -> go.Figure:
+    return chart_gradebook_combo(_df, title=title)
+
+
+@st.cache_data(show_spinner=False)
+def _cached_echo_chart(df_hash: int, _df: pd.DataFrame, students_total: Optional[int], title: str) -> go.Figure:
+    return chart_echo_combo(_df, students_total=students_total, title=title)
+
+@st.cache_data(show_spinner=False)
+def to_csv_bytes(df_hash: int, _df: pd.DataFrame, index: bool = False) -> bytes:
+    return _df.to_csv(index=index).encode("utf-8")
+
+# ---------------- Background AI analysis ----------------
+@st.cache_resource
+def _ai_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=2)
+
+
+def _run_analysis(parts: list[str], variants: int, analysis_args: dict) -> list[str]:
+    """Worker-thread body: stream a single analysis into `parts`, or fetch `variants` at once."""
+    if variants == 1:
+        for chunk in generate_analysis_stream(**analysis_args):
+            parts.append(chunk)
+        return ["".join(parts).strip()]
+    return generate_analysis_variants(**analysis_args, n=variants)
+
+
+@st.fragment(run_every=1.0)
+def _poll_ai_job() -> None:
+    """Re-render only this fragment while the analysis runs; rerun the app once it finishes."""
+    job = st.session_state["ai_job"]
+    if job["future"].done():
+        st.rerun()
+    st.caption("Analyzing your dashboard data... you can keep using the dashboard meanwhile.")
+    st.markdown("".join(job["parts"]))
+
 def sort_by_canvas_order(df: pd.DataFrame, module_col: str, canvas_df: pd.DataFrame) -> pd.DataFrame:
     """Sort a dataframe by Canvas module order using module_position; tolerate duplicate names."""
     if (
@@ -139,25 +221,21 @@ def sort_by_canvas_order(df: pd.DataFrame, module_col: str, canvas_df: pd.DataFr
     ):
         return df
 
-    # Build ordered list of module names (keep first occurrence only)
+    # Build module name -> rank lookup (keep first occurrence only)
     order = (
         canvas_df[["module", "module_position"]]
         .dropna(subset=["module"])
         .sort_values(["module_position", "module"], kind="stable")
+        .drop_duplicates("module", keep="first")
     )
-    # Deduplicate module names while preserving order
-    categories = pd.unique(order["module"].astype(str))
-
-    if len(categories) == 0:
+    if order.empty:
         return df
+    rank = pd.Series(np.arange(len(order)), index=order["module"].astype(str).to_numpy())
+    rank = rank[~rank.index.duplicated()]
 
-    out = df.copy()
-    out[module_col] = out[module_col].astype(str)
-    out[module_col] = pd.Categorical(out[module_col], categories=categories, ordered=True)
-    out = out.sort_values(module_col).reset_index(drop=True)
-    # Return as string for downstream display
-    out[module_col] = out[module_col].astype(str)
-    return out
+    # One gather by rank instead of copy + Categorical + sort; unknown modules go last
+    keys = df[module_col].astype(str).map(rank).to_numpy(dtype=float)
+    return df.take(np.argsort(keys, kind="stable")).reset_index(drop=True)
 
 # --- Table display helper (place at top level, not inside another function) ---
 def _percentize_for_display(
@@ -169,11 +247,10 @@ def _percentize_for_display(
     """
     Return (copy_of_df_with_selected_cols*100) and a Streamlit column_config for % formatting.
     """
-    disp = df.copy()
-    for col in percent_cols:
-        if col in disp.columns:
-            disp[col] = pd.to_numeric(disp[col], errors="coerce") * 100.0
-    cfg: dict[str, object] = {}
+    pct_cols = [col for col in percent_cols if col in df.columns]
+    # One new frame: the percent block is scaled in a single vectorized multiply
+    pct_block = df[pct_cols].apply(pd.to_numeric, errors="coerce").mul(100.0)
+    disp = df.assign(**{col: pct_block[col] for col in pct_cols})
     lookup: Mapping[str, str] | None
     default_help: str | None
     if isinstance(help_text, Mapping):
@@ -182,15 +259,19 @@ def _percentize_for_display(
     else:
         lookup = None
         default_help = help_text
-    for col in disp.columns:
-        help_value = lookup.get(col, default_help) if lookup else default_help
-        cfg[col] = st.column_config.Column(col, help=help_value)
-    for col in percent_cols:
-        if col in disp.columns:
-            help_value = lookup.get(col, default_help) if lookup else default_help
-            cfg[col] = st.column_config.NumberColumn(
-                col, format=f"%.{decimals}f%%", help=help_value
-            )
+
+    def _help(col: str) -> str | None:
+        return lookup.get(col, default_help) if lookup else default_help
+
+    pct_set = set(pct_cols)
+    cfg: dict[str, object] = {
+        col: (
+            st.column_config.NumberColumn(col, format=f"%.{decimals}f%%", help=_help(col))
+            if col in pct_set
+            else st.column_config.Column(col, help=_help(col))
+        )
+        for col in disp.columns
+    }
     return disp, cfg
 
 # ---------------- Wizard UI ----------------
@@ -210,10 +291,16 @@ with st.sidebar:
             "student_count",
             "echo_base_url",
             "echo_section_id",
+            "canvas_hash",
+            "frame_hashes",
+            "ai_job",
         ]:
             _state.pop(k, None)
         _state.step = 1
         st.rerun()
+    if st.button("Refresh data", help="Clear cached Canvas/Echo360 responses so the next fetch hits the APIs again."):
+        st.cache_data.clear()
+        st.rerun()
 
 # Center steps 1–2 (call this BEFORE rendering any step UI)
 _set_wizard_center(_state.step in (1, 2))
@@ -241,12 +328,15 @@ if _state.step == 1:
             with st.spinner("Fetching Canvas modules and gradebook data..."):
                 canvas_df, gradebook_tables, student_count = load_canvas_data(base_url, TOKEN, course_id)
                 _state["canvas"] = canvas_df
+                _state["canvas_hash"] = _hash_dataframe(canvas_df)
                 _state["grades"] = gradebook_tables
                 _state["base_url"] = base_url
                 _state["course_id"] = course_id
                 _state["student_count"] = student_count
                 _state.pop("echo", None)
                 _state.pop("results", None)
+                _state.pop("frame_hashes", None)
+                _state.pop("ai_job", None)
                 _state.step = 2
                 st.rerun()
         except Exception as e:
@@ -276,8 +366,11 @@ elif _state.step == 2:
                     echo_section_id,
                     _state["canvas"],
                     _state.get("student_count"),
+                    canvas_hash=_state.get("canvas_hash"),
                 )
                 _state["echo"] = echo_tables
+                _state.pop("frame_hashes", None)
+                _state.pop("ai_job", None)
                 _state["echo_base_url"] = echo_base_url
                 _state["echo_section_id"] = echo_section_id
                 _state["results"] = True
@@ -286,6 +379,64 @@ elif _state.step == 2:
         except Exception as e:
             st.error(f"Echo processing error: {e}")
 
+# ---------------- AI tab ----------------
+@st.fragment
+def _ai_tab(kpis: dict, echo_tables: EchoTables, gb_tables: GradebookTables) -> None:
+    """AI tab body; a fragment so its widgets (model, sliders) rerun only this tab."""
+    st.subheader("AI Analysis")
+    st.caption(f"ℹ️ {HELP.AI_ANALYSIS}")
+    st.caption("No identifying information will be present in this analysis. All data will be de-identified.")
+
+    # Model + settings
+    colA, colB, colC = st.columns([2,1,1])
+    with colA:
+        model = st.selectbox("Model", ["gpt-4o-mini", "gpt-4.1-mini", "gpt-4.1"], index=0)
+    with colB:
+        temperature = st.slider("Creativity", 0.0, 1.0, 0.3, 0.1)
+    with colC:
+        variants = st.slider(
+            "Compare variants", 1, 4, 1, 1,
+            help="Request several alternative analyses in one call; the data is only sent once.",
+        )
+
+    # Confirm key present (use st.secrets or env)
+    openai_key = st.secrets.get("OPENAI_API_KEY", os.getenv("OPENAI_API_KEY", ""))
+    if not openai_key:
+        st.warning("Add OPENAI_API_KEY to Streamlit secrets to enable AI analysis.")
+    else:
+        # Button to generate (runs on a worker thread; the fragment below polls it)
+        if st.button("Generate analysis"):
+            analysis_args = dict(
+                kpis=kpis,
+                echo_module_df=echo_tables.module_table if echo_tables else None,
+                gradebook_module_df=gb_tables.module_assignment_metrics_df if gb_tables else None,
+                gradebook_summary_df=gb_tables.gradebook_summary_df if gb_tables else None,
+                model=model,
+                temperature=temperature,
+            )
+            parts: list[str] = []
+            _state["ai_job"] = {
+                "parts": parts,
+                "future": _ai_executor().submit(_run_analysis, parts, variants, analysis_args),
+            }
+
+        ai_job = _state.get("ai_job")
+        if ai_job is not None:
+            if not ai_job["future"].done():
+                _poll_ai_job()
+            else:
+                try:
+                    texts = ai_job["future"].result()
+                except Exception as e:
+                    st.error(f"AI analysis failed: {e}")
+                else:
+                    if len(texts) == 1:
+                        st.markdown(texts[0])
+                    else:
+                        for vtab, text in zip(st.tabs([f"Variant {i+1}" for i in range(len(texts))]), texts):
+                            with vtab:
+                                st.markdown(text)
+
 # ---------------- Dashboard ----------------
 if st.session_state.get("results"):
     st.divider()
@@ -294,16 +445,6 @@ if st.session_state.get("results"):
     gb_tables = st.session_state["grades"]
     canvas_df = st.session_state["canvas"]
 
-    # Order by Canvas module order
-    if hasattr(gb_tables, "module_assignment_metrics_df") and not gb_tables.module_assignment_metrics_df.empty:
-        gb_tables.module_assignment_metrics_df = sort_by_canvas_order(
-            gb_tables.module_assignment_metrics_df, "Module", canvas_df
-        )
-    if hasattr(echo_tables, "module_table") and not echo_tables.module_table.empty:
-        echo_tables.module_table = sort_by_canvas_order(
-            echo_tables.module_table, "Module", canvas_df
-        )
-
     # KPIs (prefer Canvas student count when available)
     kpis = compute_kpis(
         echo_tables,
@@ -318,25 +459,43 @@ if st.session_state.get("results"):
         or (len(gb_tables.gradebook_df.index) if getattr(gb_tables, "gradebook_df", None) is not None else None)
     )
 
-    if students_total and hasattr(echo_tables, "module_table") and not echo_tables.module_table.empty:
-        echo_tables.module_table = echo_tables.module_table.copy()
-        echo_tables.module_table["# of Students"] = int(students_total)
+    # Order/decorate the module tables once per fetch; the hashes taken here key
+    # every downstream cache (charts, CSV exports) for the rest of the session.
+    if "frame_hashes" not in _state:
+        # Order by Canvas module order
+        if hasattr(gb_tables, "module_assignment_metrics_df") and not gb_tables.module_assignment_metrics_df.empty:
+            gb_tables.module_assignment_metrics_df = sort_by_canvas_order(
+                gb_tables.module_assignment_metrics_df, "Module", canvas_df
+            )
+        if hasattr(echo_tables, "module_table") and not echo_tables.module_table.empty:
+            echo_tables.module_table = sort_by_canvas_order(
+                echo_tables.module_table, "Module", canvas_df
+            )
+
+        if students_total and hasattr(echo_tables, "module_table") and not echo_tables.module_table.empty:
+            echo_tables.module_table = echo_tables.module_table.assign(**{"# of Students": int(students_total)})
+
+        _state["frame_hashes"] = {
+            "echo_summary": _hash_dataframe(echo_tables.echo_summary),
+            "echo_module": _hash_dataframe(echo_tables.module_table),
+            "gb_summary": _hash_dataframe(gb_tables.gradebook_summary_df),
+            "gb_module": _hash_dataframe(gb_tables.module_assignment_metrics_df),
+        }
+    frame_hashes = _state["frame_hashes"]
 
 
     # KPI header
-    c1, c2, c3, c4, c5 = st.columns(5)
-    c1.metric("# Students", f"{kpis.get('# Students', 0):,}", help=HELP.KPI_STUDENTS)
-    avg_grade = kpis.get("Average Grade")
-    c2.metric("Median Letter Grade", kpis.get("Median Letter Grade", "—"), help=HELP.KPI_MEDIAN_LETTER)
     avg_echo = kpis.get("Average Echo360 engagement")
-    c3.metric("Avg Echo Engagement", f"{avg_echo:.1f}%" if avg_echo is not None else "—", help=HELP.KPI_ECHO_ENGAGEMENT)
-    c4.metric("# of Fs", f"{kpis.get('# of Fs', 0):,}", help=HELP.KPI_FS)
     avg_assign = kpis.get("Avg Assignment Grade (class)")
-    c5.metric(
-        "Avg Assignment Grade",
-        f"{avg_assign*100:.1f}%" if avg_assign is not None else "—",
-        help=HELP.KPI_ASSIGNMENT_AVG,
-    )
+    kpi_row = [
+        ("# Students", f"{kpis.get('# Students', 0):,}", HELP.KPI_STUDENTS),
+        ("Median Letter Grade", kpis.get("Median Letter Grade", "—"), HELP.KPI_MEDIAN_LETTER),
+        ("Avg Echo Engagement", f"{avg_echo:.1f}%" if avg_echo is not None else "—", HELP.KPI_ECHO_ENGAGEMENT),
+        ("# of Fs", f"{kpis.get('# of Fs', 0):,}", HELP.KPI_FS),
+        ("Avg Assignment Grade", f"{avg_assign*100:.1f}%" if avg_assign is not None else "—", HELP.KPI_ASSIGNMENT_AVG),
+    ]
+    for col, (label, value, help_text) in zip(st.columns(len(kpi_row)), kpi_row):
+        col.metric(label, value, help=help_text)
 
     tab1, tab2, tab3, tab4 = st.tabs(["Tables", "Charts", "Exports", "AI Analysis"])
 
@@ -360,9 +519,8 @@ if st.session_state.get("results"):
 
 
         st.subheader("Gradebook Summary Rows")
-        gb_sum_disp = gb_tables.gradebook_summary_df.copy()
-        # all columns are fractions → scale to %
-        gb_sum_disp = gb_sum_disp.apply(pd.to_numeric, errors="coerce") * 100.0
+        # all columns are fractions → scale to % (the multiply already yields a new frame)
+        gb_sum_disp = gb_tables.gradebook_summary_df.apply(pd.to_numeric, errors="coerce") * 100.0
         gb_sum_cfg = {
             col: st.column_config.NumberColumn(col, format="%.1f%%", help=HELP.GRADEBOOK_SUMMARY_DEFAULT)
             for col in gb_sum_disp.columns
@@ -381,7 +539,9 @@ if st.session_state.get("results"):
     with tab2:
         if not gb_tables.module_assignment_metrics_df.empty:
             st.plotly_chart(
-                chart_gradebook_combo(gb_tables.module_assignment_metrics_df, title="Canvas Data"),
+                _cached_gradebook_chart(
+                    frame_hashes["gb_module"], gb_tables.module_assignment_metrics_df, title="Canvas Data"
+                ),
                 width="stretch",
             )
             st.caption(f"ℹ️ {HELP.CHART_GB}")
@@ -390,7 +550,10 @@ if st.session_state.get("results"):
 
         if not echo_tables.module_table.empty:
             st.plotly_chart(
-                chart_echo_combo(echo_tables.module_table, students_total=students_total, title="Echo Data"),
+                _cached_echo_chart(
+                    frame_hashes["echo_module"], echo_tables.module_table,
+                    students_total=students_total, title="Echo Data",
+                ),
                 width="stretch"
             )
             st.caption(f"ℹ️ {HELP.CHART_ECHO}")
@@ -399,62 +562,30 @@ if st.session_state.get("results"):
             st.info("No module-level Echo metrics to plot.")
 
     with tab3:
-        def to_csv_bytes(df: pd.DataFrame) -> bytes:
-            return df.to_csv(index=False).encode("utf-8")
-
+        # Pass callables so each CSV is only serialized when its button is clicked
         st.download_button(
             "Download Echo Summary CSV",
-            to_csv_bytes(echo_tables.echo_summary),
+            partial(to_csv_bytes, frame_hashes["echo_summary"], echo_tables.echo_summary),
             file_name="echo_summary.csv",
         )
         st.download_button(
             "Download Echo Module Table CSV",
-            to_csv_bytes(echo_tables.module_table),
+            partial(to_csv_bytes, frame_hashes["echo_module"], echo_tables.module_table),
             file_name="echo_module_table.csv",
         )
         st.download_button(
             "Download Gradebook Summary CSV",
-            gb_tables.gradebook_summary_df.to_csv().encode("utf-8"),
+            partial(to_csv_bytes, frame_hashes["gb_summary"], gb_tables.gradebook_summary_df, index=True),
             file_name="gradebook_summary.csv",
         )
         st.download_button(
             "Download Gradebook Module Metrics CSV",
-            to_csv_bytes(gb_tables.module_assignment_metrics_df),
+            partial(to_csv_bytes, frame_hashes["gb_module"], gb_tables.module_assignment_metrics_df),
             file_name="gradebook_module_metrics.csv",
         )
 
-    with tab4:
-        st.subheader("AI Analysis")
-        st.caption(f"ℹ️ {HELP.AI_ANALYSIS}")
-        st.caption("No identifying information will be present in this analysis. All data will be de-identified.")
-
-        # Model + settings
-        colA, colB = st.columns([2,1])
-        with colA:
-            model = st.selectbox("Model", ["gpt-4o-mini", "gpt-4.1-mini", "gpt-4.1"], index=0)
-        with colB:
-            temperature = st.slider("Creativity", 0.0, 1.0, 0.3, 0.1)
-
-        # Confirm key present (use st.secrets or env)
-        openai_key = st.secrets.get("OPENAI_API_KEY", os.getenv("OPENAI_API_KEY", ""))
-        if not openai_key:
-            st.warning("Add OPENAI_API_KEY to Streamlit secrets to enable AI analysis.")
-        else:
-            # Button to generate
-            if st.button("Generate analysis"):
-                with st.spinner("Analyzing your dashboard data..."):
-                    try:
-                        text = generate_analysis(
-                            kpis=kpis,
-                            echo_module_df=echo_tables.module_table if echo_tables else None,
-                            gradebook_module_df=gb_tables.module_assignment_metrics_df if gb_tables else None,
-                            gradebook_summary_df=gb_tables.gradebook_summary_df if gb_tables else None,
-                            model=model,
-                            temperature=temperature,
-                        )
-                        st.markdown(text)
-                    except Exception as e:
-                        st.error(f"AI analysis failed: {e}")
+    with tab4:
+        _ai_tab(kpis, echo_tables, gb_tables)
 
 
 
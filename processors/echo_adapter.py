@@ -8,6 +8,9 @@ import re
 import numpy as np
 import pandas as pd
 from rapidfuzz import process, fuzz
+from scipy.optimize import linear_sum_assignment
+
+from processors.labels import student_labels
 
 
 @dataclass
@@ -25,111 +28,128 @@ CANDIDATES = {
     "avgview":   ["average view time", "avg view time", "avg watch time", "average watch time"],
     "user":      ["user email", "user name", "email", "user", "viewer", "username"],
 }
+REQUIRED_COLUMNS = ("media", "duration", "viewtime")
 
-# Cleaning patterns
-_DURATION_TAIL_RE = re.compile(r"\s*\((?:\d{1,2}:)?\d{1,2}:\d{2}\)\s*$", re.I)
-_NUM_ID_TAIL_RE   = re.compile(r"\s*-\s*\d{4,}\s*$")
-_READ_ONLY_RE     = re.compile(r"\s*\(read only\)\s*$", re.I)
+# Cleaning pattern: the "- 12345" id, "(hh:mm[:ss])" duration and "(read only)" tails, each optional, in
+# that order from the end -- one pass equivalent to stripping read-only, then duration, then id in turn
+_NOISE_TAIL_RE = re.compile(
+    r"(?:\s*-\s*\d{4,}\s*)?(?:\s*\((?:\d{1,2}:)?\d{1,2}:\d{2}\)\s*)?(?:\s*\(read only\)\s*)?$", re.I
+)
 
 # Fuzzy matching knobs
 FUZZY_SCORER   = fuzz.token_set_ratio
 THRESHOLD      = 80
 FALLBACK_MIN   = 70
-TOP_K          = 6
 
 
 # ---------- helpers ----------
 
-def _find_col(df: pd.DataFrame, want: Iterable[str], required: bool = True) -> Optional[str]:
-    low = {c.lower(): c for c in df.columns}
-    for w in want:
-        if w in low:
-            return low[w]
-    for k, v in low.items():
-        if any(w in k for w in want):
-            return v
-    if required:
-        raise KeyError(f"Missing required column; need one of: {list(want)}\nAvailable: {list(df.columns)}")
-    return None
-
-
-def _to_seconds(x) -> float:
-    if pd.isna(x):
-        return np.nan
-    if isinstance(x, (int, float)):
-        return float(x)
-    s = str(x).strip()
-    if not s:
-        return np.nan
-    try:
-        return float(s)
-    except Exception:
-        pass
-    parts = s.split(":")
-    try:
-        parts = [float(p) for p in parts]
-    except Exception:
-        return np.nan
-    if len(parts) == 3:
-        h, m, sec = parts
-        return h * 3600 + m * 60 + sec
-    if len(parts) == 2:
-        m, sec = parts
-        return m * 60 + sec
-    return np.nan
-
-
-def _strip_noise_tail(title: str) -> str:
-    if not title:
-        return ""
-    s = str(title)
-    s = _READ_ONLY_RE.sub("", s)
-    s = _DURATION_TAIL_RE.sub("", s)
-    s = _NUM_ID_TAIL_RE.sub("", s)
-    return s.strip()
-
-
-def _norm_text(text: str) -> str:
-    s = _strip_noise_tail(text)
-    s = "".join(ch.lower() if (ch.isalnum() or ch.isspace()) else " " for ch in s)
-    return " ".join(s.split())
+def _resolve_columns(columns: Iterable[str]) -> dict[str, Optional[str]]:
+    """
+    Map every CANDIDATES key to an actual column in one go (exact match first,
+    then fuzzy 'contains'); the lowercase lookup is built once for all keys.
+    """
+    low = {c.lower(): c for c in columns}
+    resolved: dict[str, Optional[str]] = {}
+    for key, want in CANDIDATES.items():
+        hit = next((low[w] for w in want if w in low), None)
+        if hit is None:
+            hit = next((v for k, v in low.items() if any(w in k for w in want)), None)
+        if hit is None and key in REQUIRED_COLUMNS:
+            raise KeyError(f"Missing required column; need one of: {list(want)}\nAvailable: {list(columns)}")
+        resolved[key] = hit
+    return resolved
+
+
+def _to_seconds_series(s: pd.Series) -> pd.Series:
+    """Vectorized seconds parser: numbers pass through, "h:mm:ss" / "mm:ss" strings are split."""
+    out = pd.to_numeric(s, errors="coerce").astype(float)
+    todo = out.isna() & s.notna()
+    if todo.any():
+        parts = s[todo].astype(str).str.strip().str.split(":", expand=True)
+        n_parts = parts.notna().sum(axis=1).to_numpy()
+        nums = (
+            pd.to_numeric(parts.to_numpy(dtype=object).ravel(), errors="coerce")
+            .reshape(parts.shape)
+            .astype(float)
+        )
+        if nums.shape[1] < 3:
+            nums = np.hstack([nums, np.full((len(nums), 3 - nums.shape[1]), np.nan)])
+        a, b, c = nums[:, 0], nums[:, 1], nums[:, 2]
+        out[todo] = np.select(
+            [n_parts == 3, n_parts == 2, n_parts == 1],
+            [a * 3600 + b * 60 + c, a * 60 + b, a],
+            default=np.nan,
+        )
+    return out
 
 
-def _norm_series(s: pd.Series) -> pd.Series:
-    return s.fillna("").map(_norm_text)
+_NON_ALNUM_RE = re.compile(r"[^\w\s]|_")
+_WS_RUN_RE    = re.compile(r"\s+")
 
 
-def _greedy_match(
+def _norm_series(s: pd.Series) -> pd.Series:
+    """Column-wide match key: strip noise tails, lowercase, punctuation -> space, squeeze spaces."""
+    # Titles repeat heavily (one Canvas row per module item, one Echo row per view),
+    # so run the regex passes over the distinct values only and broadcast back
+    codes, uniques = pd.factorize(s.fillna("").astype(str))
+    out = pd.Series(uniques, dtype=object)
+    out = out.str.replace(_NOISE_TAIL_RE, "", n=1, regex=True).str.strip()
+    # Punctuation -> space before lowercasing (lowering can add marks, e.g. 'İ' -> 'i̇'), and 'Σ' on its own:
+    # a whole-string lower() would pick the context-dependent final 'ς' where a per-character one gives 'σ'
+    out = out.str.replace(_NON_ALNUM_RE, " ", regex=True).str.replace("Σ", "σ", regex=False).str.lower()
+    out = out.str.replace(_WS_RUN_RE, " ", regex=True).str.strip()
+    return pd.Series(out.to_numpy()[codes], index=s.index, dtype=object)
+
+
+def _one_to_one_match(
     ekeys: List[str],
     ckeys: List[str],
     threshold: int,
     fallback_min: int,
-    top_k: int,
 ) -> List[Tuple[int, int, int]]:
-    candidates: List[Tuple[int, int, int]] = []
-    for i, ek in enumerate(ekeys):
-        topn = process.extract(ek, ckeys, scorer=FUZZY_SCORER, limit=top_k)
-        for _, sc, j in topn:
-            if sc >= threshold:
-                candidates.append((i, j, int(sc)))
-
-    if not candidates:
-        for i, ek in enumerate(ekeys):
-            best = process.extractOne(ek, ckeys, scorer=FUZZY_SCORER)
-            if best and best[1] >= fallback_min:
-                candidates.append((i, int(best[2]), int(best[1])))
-
-    candidates.sort(key=lambda t: t[2], reverse=True)
-    used_e: set[int] = set()
-    used_c: set[int] = set()
-    chosen: List[Tuple[int, int, int]] = []
-    for i, j, sc in candidates:
-        if i in used_e or j in used_c:
-            continue
-        chosen.append((i, j, sc))
-        used_e.add(i)
-        used_c.add(j)
-    return chosen
+    """
+    Optimal one-to-one pairing of Echo keys to Canvas keys.
+
+    Identical non-empty keys are paired up front by hash lookup. The residual
+    E x C matrix is scored in one multi-threaded `cdist` call, pairs >= threshold
+    (or >= fallback_min when nothing clears the threshold) are kept, and the
+    assignment is solved with the Hungarian algorithm.
+    """
+    if not ekeys or not ckeys:
+        return []
+
+    e_first: dict[str, int] = {}
+    for i, k in enumerate(ekeys):
+        if k:
+            e_first.setdefault(k, i)
+    c_first: dict[str, int] = {}
+    for j, k in enumerate(ckeys):
+        if k:
+            c_first.setdefault(k, j)
+    exact = [(e_first[k], j, 100) for k, j in c_first.items() if k in e_first]
+
+    used_e = {i for i, _, _ in exact}
+    used_c = {j for _, j, _ in exact}
+    e_rest = [i for i in range(len(ekeys)) if i not in used_e]
+    c_rest = [j for j in range(len(ckeys)) if j not in used_c]
+    if not e_rest or not c_rest:
+        return exact
+
+    scores = process.cdist(
+        [ekeys[i] for i in e_rest], [ckeys[j] for j in c_rest], scorer=FUZZY_SCORER, workers=-1
+    )
+    cutoff = threshold if exact or (scores >= threshold).any() else fallback_min
+    # Break score ties toward the earlier Canvas row (as the exact-key pass does); the offset stays
+    # far below any real difference between ratio scores
+    tie_break = np.arange(len(c_rest)) * (1e-9 / len(c_rest))
+    eligible = np.where(scores >= cutoff, scores - tie_break, 0)
+    rows, cols = linear_sum_assignment(eligible, maximize=True)
+    return exact + [
+        (e_rest[i], c_rest[j], int(scores[i, j]))
+        for i, j in zip(rows, cols)
+        if scores[i, j] >= cutoff
+    ]
 
 
 # ---------- main builder ----------
@@ -144,46 +164,57 @@ def build_echo_tables(
 
     Fractions are in [0..1]; charts display them as 0..100%.
     """
+    # The caller's frame is never mutated: converted columns are attached with .assign below
     if isinstance(echo_csv_file, pd.DataFrame):
-        df = echo_csv_file.copy()
+        df = echo_csv_file
+        cols = _resolve_columns(df.columns)
     else:
-        df = pd.read_csv(echo_csv_file)
-
-    media_col = _find_col(df, CANDIDATES["media"], required=True)
-    dur_col   = _find_col(df, CANDIDATES["duration"], required=True)
-    view_col  = _find_col(df, CANDIDATES["viewtime"], required=True)
-    avgv_col  = _find_col(df, CANDIDATES["avgview"], required=False)
-    uid_col   = _find_col(df, CANDIDATES["user"],   required=False)
+        # Resolve the needed columns from the header alone, then parse only those
+        cols = _resolve_columns(pd.read_csv(echo_csv_file, nrows=0).columns)
+        if hasattr(echo_csv_file, "seek"):
+            echo_csv_file.seek(0)
+        df = pd.read_csv(echo_csv_file, usecols=list(dict.fromkeys(c for c in cols.values() if c)))
+
+    media_col = cols["media"]
+    dur_col   = cols["duration"]
+    view_col  = cols["viewtime"]
+    avgv_col  = cols["avgview"]
+    uid_col   = cols["user"]
 
     # Normalize time columns to seconds
-    df[dur_col]  = df[dur_col].map(_to_seconds)
-    df[view_col] = df[view_col].map(_to_seconds)
-    if avgv_col:
-        df[avgv_col] = df[avgv_col].map(_to_seconds)
+    seconds = {c: _to_seconds_series(df[c]) for c in (dur_col, view_col, avgv_col) if c}
 
     # Row-level true view fraction (0..1)
-    df["__true_view_frac"] = np.where(df[dur_col] > 0, df[view_col] / df[dur_col], np.nan)
+    # (divides only where duration > 0; other rows stay NaN, without a temporary quotient)
+    dur_s, view_s = seconds[dur_col].to_numpy(), seconds[view_col].to_numpy()
+    true_view_frac = np.divide(view_s, dur_s, out=np.full(len(dur_s), np.nan), where=dur_s > 0)
+    df = df.assign(**seconds, __true_view_frac=true_view_frac)
 
     # ---------- per-media summary ----------
-    g = df.groupby(df[media_col].astype(str))
-    # Unique viewers (prefer user id; else count non-null rows)
-    if uid_col:
-        uniq_viewers = g[uid_col].nunique(dropna=True)
-    else:
-        uniq_viewers = g[view_col].apply(lambda s: s.notna().sum())
+    # One grouped pass computes every per-media statistic
+    # Categorical key: groups on integer codes instead of rehashing every title string
+    media_key = pd.Categorical(df[media_col].astype(str))
+    per_media = df.groupby(media_key, observed=True).agg(
+        n_titles=(media_col, "count"),
+        duration=(dur_col, "first"),
+        # Unique viewers (prefer user id; else count non-null rows)
+        viewers=(uid_col, "nunique") if uid_col else (view_col, "count"),
+        n_views=(view_col, "count"),
+        sum_view=(view_col, "sum"),
+        avg_frac=("__true_view_frac", "mean"),
+    )
 
-    # Representative title & duration per media
-    title_per_media = g[media_col].agg(lambda s: s.dropna().astype(str).mode().iloc[0] if not s.dropna().empty else "")
-    dur_per_media = g[dur_col].first()
+    # The group key is the title itself ("" for rows whose media title is missing)
+    title_per_media = np.where(per_media["n_titles"] > 0, per_media.index.astype(str), "")
 
-    # Sum of all view seconds per media (for 'Overall View %')
-    sum_view_seconds = g[view_col].sum(min_count=1)
+    # Sum of all view seconds per media (for 'Overall View %'); NaN when no views recorded
+    sum_view_seconds = per_media["sum_view"].where(per_media["n_views"] > 0)
 
     echo_summary = pd.DataFrame({
-        "Media Title": title_per_media.index,
-        "Video Duration": dur_per_media.reindex(title_per_media.index).values,
-        "# of Unique Viewers": uniq_viewers.reindex(title_per_media.index).fillna(0).astype(int).values,
-        "Average View %": g["__true_view_frac"].mean().reindex(title_per_media.index).values,   # 0..1
+        "Media Title": title_per_media,
+        "Video Duration": per_media["duration"].to_numpy(),
+        "# of Unique Viewers": per_media["viewers"].fillna(0).astype(int).to_numpy(),
+        "Average View %": per_media["avg_frac"].to_numpy(),   # 0..1
     })
 
     # % of Students Viewing (media-level)
@@ -199,7 +230,7 @@ def build_echo_tables(
         denom = echo_summary["Video Duration"].astype(float) * float(class_total_students)
         with np.errstate(divide="ignore", invalid="ignore"):
             echo_summary["% of Video Viewed Overall"] = (
-                sum_view_seconds.reindex(title_per_media.index).to_numpy() / denom.to_numpy()
+                sum_view_seconds.to_numpy() / denom.to_numpy()
             )
     else:
         echo_summary["% of Video Viewed Overall"] = np.nan
@@ -222,43 +253,31 @@ def build_echo_tables(
             canvas_order_df[[module_col, "module_position", canvas_title_col]]
             .dropna(subset=[module_col, canvas_title_col])
             .rename(columns={canvas_title_col: "Canvas Title"})
-            .copy()
         )
 
-        order["_ckey"] = _norm_series(order["Canvas Title"])
-        es = echo_summary.copy()
-        es["_ekey"] = _norm_series(es["Media Title"])
+        order = order.assign(_ckey=_norm_series(order["Canvas Title"]))
+        es = echo_summary.assign(_ekey=_norm_series(echo_summary["Media Title"]))
+        # Index once by key (first row wins on duplicates); shared by the exact merge and the fuzzy fill
+        es_by_ekey = es.drop_duplicates("_ekey").set_index("_ekey")
+        fill_cols = ["Media Title", "Video Duration", "# of Unique Viewers", "Average View %", "% of Video Viewed Overall"]
 
         # 1) Exact key equality
         m1 = order.merge(
-            es[["_ekey", "Media Title", "Video Duration", "# of Unique Viewers", "Average View %", "% of Video Viewed Overall"]],
-            left_on="_ckey", right_on="_ekey", how="left"
-        )
+            es_by_ekey[fill_cols], left_on="_ckey", right_index=True, how="left", validate="m:1"
+        ).reset_index(drop=True)
 
-        # 2) Greedy one-to-one fuzzy matching for still-unmatched rows
+        # 2) Optimal one-to-one fuzzy matching for still-unmatched rows
         unmatched_idx = m1.index[m1["Average View %"].isna()].tolist()
         if unmatched_idx:
             ckeys = m1.loc[unmatched_idx, "_ckey"].fillna("").astype(str).tolist()
             ekeys = es["_ekey"].fillna("").astype(str).tolist()
-            pairs = _greedy_match(ekeys, ckeys, THRESHOLD, FALLBACK_MIN, TOP_K)
+            pairs = _one_to_one_match(ekeys, ckeys, THRESHOLD, FALLBACK_MIN)
             if pairs:
-                rows: List[dict] = []
-                for i, j, sc in pairs:
-                    m1_row_index = unmatched_idx[j]
-                    ek = ekeys[i]
-                    erow = es.loc[es["_ekey"] == ek].iloc[0]
-                    rows.append({
-                        "idx": m1_row_index,
-                        "Media Title": erow["Media Title"],
-                        "Video Duration": erow["Video Duration"],
-                        "# of Unique Viewers": erow["# of Unique Viewers"],
-                        "Average View %": erow["Average View %"],
-                        "% of Video Viewed Overall": erow["% of Video Viewed Overall"],
-                    })
-                if rows:
-                    m2 = pd.DataFrame(rows).set_index("idx")
-                    fill_cols = ["Media Title", "Video Duration", "# of Unique Viewers", "Average View %", "% of Video Viewed Overall"]
-                    m1.loc[m2.index, fill_cols] = m2[fill_cols].values
+                # Fill all pairs in one shot
+                idx_pairs = np.array(pairs)
+                m1_idx = np.take(unmatched_idx, idx_pairs[:, 1])
+                fill_keys = np.take(ekeys, idx_pairs[:, 0])
+                m1.loc[m1_idx, fill_cols] = es_by_ekey.loc[fill_keys, fill_cols].to_numpy()
 
         # Aggregate by module:
         # - Average View %  => mean of the media in module
@@ -293,20 +312,24 @@ def build_echo_tables(
 
     # ---------- de-identified student summary ----------
     if uid_col:
+        uid_key = pd.Categorical(df[uid_col].fillna("unknown"))
+        # One grouped pass; rows without a user id don't count toward anyone's seconds
         student = (
-            df.assign(_frac=df["__true_view_frac"])
-              .groupby(df[uid_col].fillna("unknown"))
-              .agg(**{"Average View % When Watched": ("_frac", "mean")})
-              .reset_index(drop=False)
-              .rename(columns={uid_col: "Student"})
+            df.assign(_secs=df[view_col].where(df[uid_col].notna()))
+              .groupby(uid_key, observed=True)
+              .agg(**{
+                  "Average View % When Watched": ("__true_view_frac", "mean"),
+                  "_secs": ("_secs", "sum"),
+                  "_n_secs": ("_secs", "count"),
+              })
+              .reset_index(drop=True)
         )
         total_seconds = df[dur_col].dropna().astype(float).sum()
-        per_user_seconds = df.groupby(uid_col)[view_col].sum(min_count=1)
         student["View % of Total Video"] = (
-            per_user_seconds.reindex(student["Student"]).to_numpy() / total_seconds
+            student["_secs"].where(student["_n_secs"] > 0) / total_seconds
             if total_seconds else np.nan
         )
-        student["Student"] = [f"S{ix+1:04d}" for ix in range(len(student))]
+        student["Student"] = student_labels(len(student))
         student_table = student[["Student", "Average View % When Watched", "View % of Total Video"]]
         student_table["Final Grade"] = np.nan
     else:
@@ -314,8 +337,18 @@ def build_echo_tables(
             "Student", "Final Grade", "Average View % When Watched", "View % of Total Video"
         ])
 
-    if "__true_view_frac" in df.columns:
-        del df["__true_view_frac"]
+    # Compact dtypes for the frames Streamlit re-serializes on every rerun; done last so
+    # the module means above are still taken over float64 values
+    echo_summary = echo_summary.astype({
+        "Video Duration": "float32",
+        "# of Unique Viewers": "Int32",
+        "Average View %": "float32",
+        "% of Students Viewing": "float32",
+        "% of Video Viewed Overall": "float32",
+    })
+    module_table = module_table.astype(dict.fromkeys(
+        ["Average View %", "# of Students Viewing", "Overall View %", "# of Students"], "float32"
+    ))
 
     return EchoTables(
         echo_summary=echo_summary,
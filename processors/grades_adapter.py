@@ -3,11 +3,14 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from typing import Iterable, List
+import re
 
 import numpy as np
 import pandas as pd
 from rapidfuzz import process, fuzz
 
+from processors.labels import student_labels
+
 
 @dataclass
 class GradebookTables:
@@ -31,6 +34,12 @@ IDENTITY_OR_META = {
     "final points", "current points", "unposted current score",
 }
 
+# Canvas trailing id: "... - 1234567" and/or "... (1234567)" (the dash form may precede the paren form)
+_CANVAS_ID_TAIL_RE = re.compile(r"(?:\s*-\s*\d{4,})?(?:\s*\(\d{4,}\))?$")
+
+# Gradebook rows that are not real students (points row, Canvas test student)
+_NON_STUDENT_ROW_RE = re.compile(r"points possible|student, test", re.I)
+
 
 # ---------- helpers ----------
 
@@ -51,38 +60,23 @@ def _clean_assignment_header(name: str) -> str:
       - "Assignment Name (1234567)"
       - "Assignment Name - 1234567"
     """
-    s = str(name).strip()
-    if not s:
-        return s
+    return _CANVAS_ID_TAIL_RE.sub("", str(name).strip(), count=1).strip()
 
-    # Remove trailing '(digits)'
-    if s.endswith(")") and "(" in s:
-        i = s.rfind("(")
-        digits = s[i + 1 : -1]
-        if digits.isdigit() and len(digits) >= 4:
-            s = s[:i].rstrip()
 
-    # Remove trailing '- digits'
-    if "-" in s:
-        left, right = s.rsplit("-", 1)
-        if right.strip().isdigit() and len(right.strip()) >= 4:
-            s = left.strip()
-
-    return s
+def _clean_assignment_headers(names: Iterable[str]) -> List[str]:
+    """Column-wide `_clean_assignment_header`: one regex pass over all names."""
+    s = pd.Series(list(names), dtype=object).astype(str).str.strip()
+    return s.str.replace(_CANVAS_ID_TAIL_RE, "", n=1, regex=True).str.strip().tolist()
 
 
 def _deidentify_students(df: pd.DataFrame) -> pd.DataFrame:
     """Replace any 'Student' column with S0001… labels and drop obvious PII ids."""
-    out = df.copy()
-    low = _lower_map(out.columns)
+    low = _lower_map(df.columns)
+    # Drop SIS/internal ids if present (returns a new frame; the input is left untouched)
+    out = df.drop(columns=[low[k] for k in ["sis user id", "sis login id", "integration id", "id"] if k in low])
     # De-identify student name if present
     if "student" in low:
-        n = len(out)
-        out[low["student"]] = [f"S{i+1:04d}" for i in range(n)]
-    # Drop SIS/internal ids if present
-    for k in ["sis user id", "sis login id", "integration id", "id"]:
-        if k in low:
-            out.drop(columns=[low[k]], inplace=True)
+        out = out.assign(**{low["student"]: student_labels(len(out))})
     return out
 
 
@@ -110,12 +104,12 @@ def build_gradebook_tables(gradebook_csv_file, canvas_order_df: pd.DataFrame) ->
       - Percentages returned as fractions 0..1.
     """
     if isinstance(gradebook_csv_file, pd.DataFrame):
-        gb_raw = gradebook_csv_file.copy()
+        gb_raw = gradebook_csv_file
     else:
         gb_raw = pd.read_csv(gradebook_csv_file)
-
-    # Clean headers (strip trailing numeric IDs)
-    gb_raw.columns = [_clean_assignment_header(c) for c in gb_raw.columns]
+
+    # Clean headers (strip trailing numeric IDs); set_axis leaves the caller's frame alone
+    gb_raw = gb_raw.set_axis(_clean_assignment_headers(gb_raw.columns), axis=1)
 
     if gb_raw.empty:
         return GradebookTables(pd.DataFrame(), pd.DataFrame(), pd.DataFrame())
@@ -127,36 +121,51 @@ def build_gradebook_tables(gradebook_csv_file, canvas_order_df: pd.DataFrame) ->
     # Remove non-student / read-only rows if they slipped in
     # (basic heuristic: drop rows where 'Student' contains "points possible" or "student, test")
     low = _lower_map(students_raw.columns)
-    filt = pd.Series([True] * len(students_raw))
     if "student" in low:
-        s = students_raw[low["student"]].astype(str).str.lower()
-        filt &= ~s.str.contains("points possible")
-        filt &= ~s.str.contains("student, test")
-    students_raw = students_raw[filt].reset_index(drop=True)
+        non_student = students_raw[low["student"]].astype(str).str.contains(_NON_STUDENT_ROW_RE, na=False)
+        students_raw = students_raw.loc[~non_student].reset_index(drop=True)
 
     # Identify assignment columns
     assignment_cols = _assignment_columns(gb_raw)
     if not assignment_cols:
         # No assignment columns; build minimal outputs
-        gradebook_df = _deidentify_students(students_raw.copy())
+        gradebook_df = _deidentify_students(students_raw)
         gradebook_summary_df = pd.DataFrame(index=["Average", "Average Excluding Zeros", "% Turned In"])
         module_assignment_metrics_df = pd.DataFrame(columns=["Module", "Avg % Turned In", "Avg Average Excluding Zeros", "n_assignments"])
         return GradebookTables(gradebook_df, gradebook_summary_df, module_assignment_metrics_df)
 
     # Convert points possible + earned to numeric
-    points = pd.to_numeric(points_row[assignment_cols], errors="coerce")
-    earned = students_raw[assignment_cols].apply(pd.to_numeric, errors="coerce")
+    # (one to_numeric call over the flattened block instead of one per column)
+    points_raw = points_row[assignment_cols]
+    points = pd.Series(
+        pd.to_numeric(points_raw.to_numpy(dtype=object), errors="coerce"),
+        index=points_raw.index,
+        dtype="float64",
+    )
+    earned_raw = students_raw[assignment_cols]
+    earned = pd.DataFrame(
+        pd.to_numeric(earned_raw.to_numpy(dtype=object).ravel(), errors="coerce")
+        .astype("float64")
+        .reshape(earned_raw.shape),
+        index=earned_raw.index,
+        columns=earned_raw.columns,
+    )
 
     # Per-assignment percentage as FRACTIONS 0..1
     perc = earned.divide(points, axis=1)
 
-    # Summary rows
-    avg = perc.mean(skipna=True)                             # includes zeros
-    excl0 = perc.mask(perc == 0).mean(skipna=True)           # zeros treated as missing
-    turned_in = (perc > 0).mean(skipna=True)                 # share of nonzero submissions
+    # Summary rows, all derived from one set of column sums/counts over the matrix
+    arr = perc.to_numpy()
+    valid = ~np.isnan(arr)
+    col_sums = np.where(valid, arr, 0.0).sum(axis=0)         # zeros add nothing, so this serves both averages
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg = col_sums / valid.sum(axis=0)                   # includes zeros
+        excl0 = col_sums / (valid & (arr != 0)).sum(axis=0)  # zeros treated as missing
+        turned_in = (arr > 0).sum(axis=0) / len(arr)         # share of nonzero submissions
     gradebook_summary_df = pd.DataFrame(
         [avg, excl0, turned_in],
         index=["Average", "Average Excluding Zeros", "% Turned In"],
+        columns=perc.columns,
     )
 
     # De-identify student rows for any downstream use; also preserve key grade columns if present
@@ -164,7 +173,7 @@ def build_gradebook_tables(gradebook_csv_file, canvas_order_df: pd.DataFrame) ->
     for k in ["Final Grade", "Current Grade", "Unposted Final Grade", "Final Score", "Current Score", "Unposted Final Score"]:
         if k in gb_raw.columns:
             keep_cols.append(k)
-    gradebook_df = students_raw[keep_cols].copy() if keep_cols else students_raw.copy()
+    gradebook_df = students_raw[keep_cols] if keep_cols else students_raw
     gradebook_df = _deidentify_students(gradebook_df)
 
     # ---------- module-level metrics ----------
@@ -176,19 +185,25 @@ def build_gradebook_tables(gradebook_csv_file, canvas_order_df: pd.DataFrame) ->
         ]
 
         gb_cols = assignment_cols  # already header-cleaned
-
-        for mod, grp in canvas_assign.groupby("module"):
-            cols_for_mod: List[str] = []
-
-            for title in grp["item_title_raw"].dropna().astype(str):
-                # Clean the Canvas title similarly (helps when Canvas also appends IDs)
-                cleaned_title = _clean_assignment_header(title)
-                # RapidFuzz match against gradebook assignment headers
-                match = process.extractOne(cleaned_title, gb_cols, scorer=fuzz.ratio)
-                if match and match[1] >= 90:
-                    cols_for_mod.append(match[0])
-
-            cols_for_mod = sorted(set(cols_for_mod))
+        canvas_assign = canvas_assign.dropna(subset=["item_title_raw"])
+
+        # Clean the Canvas titles similarly (helps when Canvas also appends IDs)
+        cleaned_titles = _clean_assignment_headers(canvas_assign["item_title_raw"].astype(str))
+        if cleaned_titles:
+            # One title x header score matrix (C++, multi-threaded) instead of an extractOne per title
+            scores = process.cdist(cleaned_titles, gb_cols, scorer=fuzz.ratio, workers=-1)
+            keep = scores.max(axis=1) >= 90
+            matched = pd.DataFrame({
+                "module": canvas_assign["module"].to_numpy()[keep],
+                "column": np.asarray(gb_cols, dtype=object)[scores.argmax(axis=1)[keep]],
+            })
+        else:
+            matched = pd.DataFrame(columns=["module", "column"])
+
+        # Categorical module key: integer-code grouping, same (sorted) module order
+        module_key = pd.Categorical(matched["module"])
+        for mod, matched_cols in matched.groupby(module_key, observed=True)["column"]:
+            cols_for_mod = sorted(set(matched_cols))
             if cols_for_mod:
                 module_rows.append(
                     {
@@ -201,7 +216,10 @@ def build_gradebook_tables(gradebook_csv_file, canvas_order_df: pd.DataFrame) ->
 
     module_assignment_metrics_df = pd.DataFrame(
         module_rows, columns=["Module", "Avg % Turned In", "Avg Average Excluding Zeros", "n_assignments"]
-    )
+    ).astype({"Avg % Turned In": "float32", "Avg Average Excluding Zeros": "float32", "n_assignments": "Int32"})
+
+    # float32 halves what Streamlit serializes per rerun; module means above used float64
+    gradebook_summary_df = gradebook_summary_df.astype("float32")
 
     return GradebookTables(
         gradebook_df=gradebook_df,
@@ -0,0 +1,11 @@
+# processors/labels.py
+from __future__ import annotations
+
+import numpy as np
+
+
+def student_labels(n: int) -> np.ndarray:
+    """De-identified labels S0001..S{n:04d}, built with NumPy string ops."""
+    if n <= 0:
+        return np.array([], dtype=str)
+    return np.char.add("S", np.char.zfill(np.arange(1, n + 1).astype(str), 4))
@@ -1,12 +1,42 @@
 # services/canvas.py
 from __future__ import annotations
 
-from typing import Optional, List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from html import unescape
+from typing import Iterator, Optional, List, Dict, Tuple
 import re
 
 import httpx
+import lxml.html
+import numpy as np
 import pandas as pd
-from bs4 import BeautifulSoup
+from lxml import etree
+
+from services.http_cache import ETagCache
+from services.pagination import next_link
+
+# Bytes in, explicit UTF-8: tolerates bodies that carry an <?xml encoding=...?> declaration
+_HTML_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+
+# Editor-generated iframe tags: quoted values may contain '>', attribute names may contain '-'
+_IFRAME_OPEN_RE = re.compile(r"<iframe(?=[\s/>])")  # run on the lowercased body
+_IFRAME_TAG_RE = re.compile(r"""<iframe(?=[\s/>])((?:[^>"']|"[^"]*"|'[^']*')*)>""", re.I)
+_TAG_ATTR_RE = re.compile(r"""([^\s"'=<>/]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+)))?""")
+# Attribute text html.unescape decodes differently from libxml2 (bare '&', uncommon named entities, CR)
+_TAG_AMBIGUOUS_RE = re.compile(r"\r|&(?!(?:amp|lt|gt|quot|apos|nbsp|#\d+|#[xX][0-9a-fA-F]+);)")
+# Where a regex cannot tell a real <iframe> from text, the body goes through lxml: raw-text/comment
+# constructs, and an "<iframe" inside another tag's attribute value (e.g. alt="<iframe ...>").
+# Run on the lowercased body (literal-prefixed patterns without re.I scan much faster; kept separate for that)
+_REGEX_UNSAFE_RE = re.compile(
+    r"<(?:!--|!\[cdata\[|(?:script|style|textarea|title|xmp|noscript|noembed|noframes|plaintext)\b)"
+)
+_IFRAME_IN_ATTR_RE = re.compile(r"""=\s*(?:"[^"]*|'[^']*)?<iframe""")
+
+
+def _by_position(obj: Dict) -> int:
+    """Sort key for Canvas modules/items; a missing or null position sorts first."""
+    return obj.get("position") or 0
 
 
 class CanvasService:
@@ -24,61 +54,55 @@ class CanvasService:
         self.client = httpx.Client(
             headers={"Authorization": f"Bearer {token}"},
             timeout=timeout,
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=16, keepalive_expiry=60),
         )
+        # Revalidates repeat GETs with If-None-Match (e.g. after "Refresh data")
+        self.etag_cache = ETagCache()
 
     # ---------------- Internal helpers ----------------
 
-    def _get_all(self, url: str, params: Dict | None = None) -> List[Dict]:
-        out: List[Dict] = []
+    def _iter_pages(self, url: str, params: Dict | None = None) -> Iterator[List[Dict]]:
+        """Yield each page's items in turn, following Link rel="next", without accumulating them."""
         next_url = url
         next_params = params or {}
 
         while next_url:
-            r = self.client.get(next_url, params=next_params)
-            r.raise_for_status()
-            data = r.json()
+            data, link = self.etag_cache.get_json(self.client, next_url, params=next_params)
             if isinstance(data, list):
-                out.extend(data)
+                yield data
             elif isinstance(data, dict):
-                out.append(data)
+                yield [data]
 
-            # Parse Link header for rel="next"
-            next_url = None
-            link = r.headers.get("Link")
-            if link:
-                for part in (p.strip() for p in link.split(",")):
-                    if 'rel="next"' in part:
-                        next_url = part.split(";")[0].strip().strip("<>").strip()
-                        break
+            next_url = next_link(link)
 
             # only pass params on first request
             next_params = None
 
+    def _get_all(self, url: str, params: Dict | None = None) -> List[Dict]:
+        out: List[Dict] = []
+        extend = out.extend
+        for page in self._iter_pages(url, params):
+            extend(page)
         return out
 
-    @staticmethod
-    def _clean_assignment_title(name: str) -> str:
-        """Mimic Canvas CSV export header cleaning for assignments."""
-        if not name:
-            return ""
-        s = str(name).strip()
-
-        if s.endswith(")") and "(" in s:
-            i = s.rfind("(")
-            digits = s[i + 1 : -1]
-            if digits.isdigit() and len(digits) >= 4:
-                s = s[:i].rstrip()
-
-        if "-" in s:
-            left, right = s.rsplit("-", 1)
-            if right.strip().isdigit() and len(right.strip()) >= 4:
-                s = left.strip()
+    # Canvas trailing id: "... - 1234567" and/or "... (1234567)" (the dash form may precede the paren form)
+    _ID_TAIL_RE = re.compile(r"(?:\s*-\s*\d{4,})?(?:\s*\(\d{4,}\))?$")
 
-        return s
+    @classmethod
+    def _clean_assignment_titles(cls, names: List[Optional[str]]) -> List[str]:
+        """Mimic Canvas CSV export header cleaning for assignments (one regex pass over all names)."""
+        s = pd.Series(names, dtype=object)
+        s = s.where(s.astype(bool), "").astype(str).str.strip()
+        return s.str.replace(cls._ID_TAIL_RE, "", n=1, regex=True).str.strip().tolist()
 
     @staticmethod
     def _dedupe_titles(titles: List[Tuple[int, str]]) -> List[Tuple[int, str]]:
         """Ensure assignment titles are unique while preserving order."""
+        bases = [(aid, title or "Assignment") for aid, title in titles]
+        # Common case: nothing collides, so no renaming bookkeeping is needed
+        if len({base for _, base in bases}) == len(bases):
+            return bases
         seen: Dict[str, int] = {}
         out: List[Tuple[int, str]] = []
         for aid, title in titles:
@@ -93,20 +117,18 @@ class CanvasService:
             out.append((aid, unique))
         return out
 
-    # Title cleanup patterns: (hh:mm[:ss]), "(read only)", "- 12345"
-    _DUR_TAIL_RE   = re.compile(r"\s*\((?:\d{1,2}:)?\d{1,2}:\d{2}\)\s*$", re.I)
-    _READONLY_RE   = re.compile(r"\s*\(read only\)\s*$", re.I)
-    _NUM_ID_TAIL_RE = re.compile(r"\s*-\s*\d{4,}\s*$")
+    # Title cleanup: optional "- 12345", "(hh:mm[:ss])" and "(read only)" tails in that order from the end;
+    # one pass equivalent to stripping read-only, then duration, then id in turn
+    _NOISE_TAIL_RE = re.compile(
+        r"(?:\s*-\s*\d{4,}\s*)?(?:\s*\((?:\d{1,2}:)?\d{1,2}:\d{2}\)\s*)?(?:\s*\(read only\)\s*)?$", re.I
+    )
 
     @classmethod
-    def _strip_noise(cls, title: str) -> str:
-        if not title:
-            return ""
-        t = str(title).strip()
-        t = cls._READONLY_RE.sub("", t)
-        t = cls._DUR_TAIL_RE.sub("", t)
-        t = cls._NUM_ID_TAIL_RE.sub("", t)
-        return t.strip()
+    def _strip_noise_titles(cls, titles: List[Optional[str]]) -> List[str]:
+        """Strip the noise tails from every title with one column-wide `.str` regex pass."""
+        s = pd.Series(titles, dtype=object)
+        t = s.where(s.astype(bool), "").astype(str).str.strip()
+        return t.str.replace(cls._NOISE_TAIL_RE, "", n=1, regex=True).str.strip().tolist()
 
     # ---------------- Public API: modules & items ----------------
 
@@ -138,33 +160,86 @@ class CanvasService:
     def get_page_body(self, course_id: int, page_url: str) -> str:
         """Fetch a Canvas page body (HTML)."""
         url = f"{self.base_url}/api/v1/courses/{course_id}/pages/{page_url}"
-        r = self.client.get(url)
-        r.raise_for_status()
-        return r.json().get("body") or ""
+        data, _ = self.etag_cache.get_json(self.client, url)
+        return data.get("body") or ""
+
+    # Concurrent page fetches; matches the client's keep-alive pool size
+    _PAGE_FETCH_WORKERS = 16
+
+    def get_page_bodies(self, course_id: int, page_urls: List[str]) -> Dict[str, str]:
+        """
+        Fetch many page bodies concurrently over the shared client.
+        Pages that answer with an HTTP error map to "" (same as a page with no body).
+        """
+        def fetch(page_url: str) -> str:
+            try:
+                return self.get_page_body(course_id, page_url)
+            except httpx.HTTPStatusError:
+                return ""
+
+        unique = list(dict.fromkeys(page_urls))
+        if not unique:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self._PAGE_FETCH_WORKERS, len(unique))) as pool:
+            return dict(zip(unique, pool.map(fetch, unique)))
+
+    @staticmethod
+    def _iframe_src_titles(html: str) -> List[Tuple[str, str]]:
+        """(src, title) of every <iframe>: one regex scan, or an lxml parse for bodies a regex can't read safely."""
+        lowered = html.lower()
+        if "<iframe" not in lowered:
+            return []  # most pages: no tag to find, no parse needed
+        if not _REGEX_UNSAFE_RE.search(lowered) and not _IFRAME_IN_ATTR_RE.search(lowered):
+            tags = _IFRAME_TAG_RE.findall(html)
+            # Every opening tag must have matched; a malformed one (e.g. unbalanced quotes) needs the parser's recovery
+            if len(tags) == len(_IFRAME_OPEN_RE.findall(lowered)) and not any(
+                _TAG_AMBIGUOUS_RE.search(tag) for tag in tags
+            ):
+                out: List[Tuple[str, str]] = []
+                for tag in tags:
+                    attrs: Dict[str, str] = {}
+                    for name, dq, sq, bare in _TAG_ATTR_RE.findall(tag):
+                        attrs.setdefault(name.lower(), dq or sq or bare)  # first occurrence wins, as in the parser
+                    out.append((unescape(attrs.get("src", "")), unescape(attrs.get("title", ""))))
+                return out
+        try:
+            # C-backed parse; we only walk <iframe> elements, so no soup tree is needed
+            root = lxml.html.fromstring(html.encode("utf-8"), parser=_HTML_PARSER)
+        except etree.ParserError:
+            return []  # e.g. whitespace- or comment-only bodies
+        return [(iframe.get("src") or "", iframe.get("title") or "") for iframe in root.iter("iframe")]
+
+    @staticmethod
+    @lru_cache(maxsize=512)
+    def _echo_embed_titles(html: str) -> Tuple[Tuple[str, str], ...]:
+        """
+        (cleaned, original) title pairs for the Echo iframes in one page body.
+        Cached by body: a page revalidated with a 304 returns the same body, so it is not re-scanned.
+        """
+        titles: List[str] = []
+        for src, iframe_title in CanvasService._iframe_src_titles(html):
+            # Echo360 direct or Canvas external tools' retrieve URLs
+            if ("echo360.org" not in src) and ("external_tools/retrieve" not in src):
+                continue
+            iframe_title = iframe_title.strip()
+            if iframe_title:
+                titles.append(iframe_title)
+        if not titles:
+            return ()
+        return tuple(zip(CanvasService._strip_noise_titles(titles), titles))
 
     @staticmethod
     def _extract_echo_embeds_from_html(html: str) -> List[Dict]:
         """Parse <iframe> embeds that look like Echo360 and return their titles (raw, cleaned)."""
         if not html:
             return []
-        soup = BeautifulSoup(html, "html.parser")
-        out: List[Dict] = []
-        for iframe in soup.find_all("iframe"):
-            src = iframe.get("src", "") or ""
-            # Echo360 direct or Canvas external tools' retrieve URLs
-            if ("echo360.org" not in src) and ("external_tools/retrieve" not in src):
-                continue
-            iframe_title = (iframe.get("title") or "").strip()
-            if not iframe_title:
-                continue
-            cleaned = CanvasService._strip_noise(iframe_title)
-            out.append(
-                {
-                    "video_title_raw": cleaned,                # duration etc. stripped
-                    "video_title_original": iframe_title,      # original title in iframe
-                }
-            )
-        return out
+        return [
+            {
+                "video_title_raw": cleaned,                # duration etc. stripped
+                "video_title_original": iframe_title,      # original title in iframe
+            }
+            for cleaned, iframe_title in CanvasService._echo_embed_titles(html)
+        ]
 
     def build_order_df(self, course_id: int) -> pd.DataFrame:
         """
@@ -183,70 +258,79 @@ class CanvasService:
         """
         modules = self.list_modules_with_items(course_id)
 
-        rows: List[Dict] = []
-        for m in sorted(modules, key=lambda x: x.get("position", 0)):
+        # Fetch every Page body up front (concurrently) instead of one request per loop step
+        bodies = self.get_page_bodies(
+            course_id,
+            [
+                it["page_url"]
+                for m in modules
+                for it in m.get("items") or []
+                if it.get("type") == "Page" and it.get("page_url")
+            ],
+        )
+
+        # Column lists (one append per field) instead of a dict + .copy() per row
+        cols: Dict[str, List] = {name: [] for name in (
+            "module", "module_position", "item_type", "item_position", "item_title_raw",
+            "item_title_normalized", "video_title_raw", "html_url", "external_url",
+        )}
+        tool_rows: List[int] = []  # ExternalTool/Url video rows whose titles get cleaned in one pass below
+        for m in sorted(modules, key=_by_position):
             mod_name = m.get("name")
             mod_pos = m.get("position")
-            for it in sorted(m.get("items", []), key=lambda x: x.get("position", 0)):
+            for it in sorted(m.get("items") or [], key=_by_position):
                 item_type = it.get("type")
                 title = (it.get("title") or "").strip()
-                item_pos = it.get("position")
-                html_url = it.get("html_url")
                 external_url = it.get("external_url")
 
-                # Default row (non-video items still useful for gradebook mapping)
-                base_row = {
-                    "module": mod_name,
-                    "module_position": mod_pos,
-                    "item_type": item_type,
-                    "item_position": item_pos,
-                    "item_title_raw": title,
-                    "item_title_normalized": title.casefold(),
-                    "video_title_raw": None,  # filled for Echo videos below
-                    "html_url": html_url,
-                    "external_url": external_url,
-                }
+                # One row per video title; non-video items still get one row (useful for gradebook mapping)
+                video_titles: List[Optional[str]] = [None]
 
                 # ---- Echo videos via ExternalTool / ExternalUrl ----
                 if item_type in ("ExternalTool", "ExternalUrl"):
-                    url = external_url or ""
-                    if "echo360.org" in url:
+                    if "echo360.org" in (external_url or ""):
                         # Canvas item title typically mirrors Echo media title (with duration) → clean it
-                        vr = self._strip_noise(title)
-                        row = base_row.copy()
-                        row["video_title_raw"] = vr
-                        rows.append(row)
-                        continue  # done
+                        tool_rows.append(len(cols["video_title_raw"]))
+                        video_titles = [title]
 
                 # ---- Echo videos embedded inside a Page ----
-                if item_type == "Page":
-                    page_url = it.get("page_url")
-                    try:
-                        body = self.get_page_body(course_id, page_url) if page_url else ""
-                    except httpx.HTTPStatusError:
-                        body = ""
+                elif item_type == "Page":
+                    body = bodies.get(it.get("page_url") or "", "")
                     embeds = self._extract_echo_embeds_from_html(body)
                     if embeds:
-                        for e in embeds:
-                            row = base_row.copy()
-                            row["video_title_raw"] = e["video_title_raw"]
-                            rows.append(row)
-                        continue  # already appended embed rows
+                        video_titles = [e["video_title_raw"] for e in embeds]
                     # No echo embeds found → still keep the page row (non-video)
-                    rows.append(base_row)
-                    continue
 
-                # ---- Other items (Assignments, Quizzes, Discussions, Files, etc.) ----
-                rows.append(base_row)
-
-        df = pd.DataFrame(rows)
+                n = len(video_titles)
+                cols["module"] += [mod_name] * n
+                cols["module_position"] += [mod_pos] * n
+                cols["item_type"] += [item_type] * n
+                cols["item_position"] += [it.get("position")] * n
+                cols["item_title_raw"] += [title] * n
+                cols["item_title_normalized"] += [title.casefold()] * n
+                cols["video_title_raw"] += video_titles
+                cols["html_url"] += [it.get("html_url")] * n
+                cols["external_url"] += [external_url] * n
+
+        if tool_rows:
+            titles = cols["video_title_raw"]
+            for i, vr in zip(tool_rows, self._strip_noise_titles([titles[i] for i in tool_rows])):
+                titles[i] = vr
+
+        df = pd.DataFrame(cols)
         return df
 
+    def _fetch_gradebook_sources(self, course_id: int) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+        """Assignments, student enrollments and submissions, paginated concurrently (the endpoints are independent)."""
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            assignments = pool.submit(self.list_assignments, course_id)
+            enrollments = pool.submit(self.list_student_enrollments, course_id)
+            submissions = pool.submit(self.list_submissions, course_id)
+            return assignments.result(), enrollments.result(), submissions.result()
+
     def build_gradebook_dataframe(self, course_id: int) -> pd.DataFrame:
         """Assemble a Canvas gradebook shaped like the CSV export but via API calls."""
-        assignments = self.list_assignments(course_id)
-        enrollments = self.list_student_enrollments(course_id)
-        submissions = self.list_submissions(course_id)
+        assignments, enrollments, submissions = self._fetch_gradebook_sources(course_id)
 
         if not enrollments:
             return pd.DataFrame(columns=["Student"])
@@ -261,78 +345,74 @@ class CanvasService:
                 continue
             graded_assignments.append(a)
 
-        cleaned_titles = [
-            (a.get("id"), self._clean_assignment_title(a.get("name")))
-            for a in graded_assignments
-            if a.get("id") is not None
-        ]
+        with_ids = [a for a in graded_assignments if a.get("id") is not None]
+        cleaned_titles = list(zip(
+            [a.get("id") for a in with_ids],
+            self._clean_assignment_titles([a.get("name") for a in with_ids]),
+        ))
         unique_titles = self._dedupe_titles(cleaned_titles)
 
         assignment_lookup = {a.get("id"): a for a in graded_assignments}
-        submission_lookup: Dict[Tuple[int, int], float | None] = {}
+
+        # Column-oriented assembly: one list per meta column, one float matrix for scores
+        users = [e.get("user") or {} for e in enrollments]
+        grades = [e.get("grades") or {} for e in enrollments]
+        meta: Dict[str, List[object]] = {
+            "Student": [
+                u.get("sortable_name") or u.get("name") or e.get("user_id") or "Student"
+                for e, u in zip(enrollments, users)
+            ],
+            "SIS User ID": [e.get("sis_user_id") or u.get("sis_user_id") for e, u in zip(enrollments, users)],
+            "SIS Login ID": [e.get("sis_login_id") or u.get("login_id") for e, u in zip(enrollments, users)],
+            "Integration ID": [e.get("integration_id") for e in enrollments],
+            "ID": [e.get("user_id") for e in enrollments],
+            "Section": [e.get("course_section_id") for e in enrollments],
+        }
+        for col, key in (
+            ("Final Grade", "final_grade"),
+            ("Current Grade", "current_grade"),
+            ("Unposted Final Grade", "unposted_final_grade"),
+            ("Final Score", "final_score"),
+            ("Current Score", "current_score"),
+            ("Unposted Final Score", "unposted_final_score"),
+        ):
+            meta[col] = [g.get(key) for g in grades]
+        # Row 0 is the "Points Possible" row, like the CSV export
+        meta_df = pd.DataFrame({
+            col: ["Points Possible" if col == "Student" else None] + values
+            for col, values in meta.items()
+        })
+
+        # Student x assignment scores: integer row/col indices into a dense NaN grid, one store per submission.
+        # Row 0 holds points possible, so the final gather yields the CSV-shaped block without a vstack copy
+        assignment_ids = [int(aid) for aid, _ in unique_titles]
+        user_ids = [int(e["user_id"]) if e.get("user_id") is not None else -1 for e in enrollments]
+        row_of = {uid: i for i, uid in enumerate(dict.fromkeys(user_ids), start=1)}
+        col_of = {aid: j for j, aid in enumerate(dict.fromkeys(assignment_ids))}
+        cols = [col_of[a] for a in assignment_ids]
+        grid = np.full((len(row_of) + 1, len(col_of)), np.nan)
+        grid[0, cols] = np.array(
+            [assignment_lookup.get(aid, {}).get("points_possible") for aid, _ in unique_titles],
+            dtype="float64",
+        )
         for sub in submissions:
             user_id = sub.get("user_id")
             assignment_id = sub.get("assignment_id")
             if user_id is None or assignment_id is None:
                 continue
-            if assignment_id not in assignment_lookup:
+            i = row_of.get(int(user_id))
+            j = col_of.get(int(assignment_id))
+            if i is None or j is None:
                 continue
-            submission_lookup[(int(user_id), int(assignment_id))] = sub.get("score")
-
-        meta_cols = [
-            "Student",
-            "SIS User ID",
-            "SIS Login ID",
-            "Integration ID",
-            "ID",
-            "Section",
-            "Final Grade",
-            "Current Grade",
-            "Unposted Final Grade",
-            "Final Score",
-            "Current Score",
-            "Unposted Final Score",
-        ]
-        assignment_cols = [title for _, title in unique_titles]
-        columns = meta_cols + assignment_cols
-
-        rows: List[Dict[str, object]] = []
-        points_row = {col: None for col in columns}
-        points_row["Student"] = "Points Possible"
-        for assignment_id, title in unique_titles:
-            points_row[title] = assignment_lookup.get(assignment_id, {}).get("points_possible")
-        rows.append(points_row)
-
-        for enrollment in enrollments:
-            row = {col: None for col in columns}
-            user = enrollment.get("user") or {}
-            grades = enrollment.get("grades") or {}
-            row["Student"] = (
-                user.get("sortable_name")
-                or user.get("name")
-                or enrollment.get("user_id")
-                or "Student"
-            )
-            row["SIS User ID"] = enrollment.get("sis_user_id") or user.get("sis_user_id")
-            row["SIS Login ID"] = enrollment.get("sis_login_id") or user.get("login_id")
-            row["Integration ID"] = enrollment.get("integration_id")
-            row["ID"] = enrollment.get("user_id")
-            row["Section"] = enrollment.get("course_section_id")
-            row["Final Grade"] = grades.get("final_grade")
-            row["Current Grade"] = grades.get("current_grade")
-            row["Unposted Final Grade"] = grades.get("unposted_final_grade")
-            row["Final Score"] = grades.get("final_score")
-            row["Current Score"] = grades.get("current_score")
-            row["Unposted Final Score"] = grades.get("unposted_final_score")
-
-            user_id = enrollment.get("user_id")
-            for assignment_id, title in unique_titles:
-                if user_id is None:
-                    continue
-                row[title] = submission_lookup.get((int(user_id), int(assignment_id)))
-            rows.append(row)
-
-        return pd.DataFrame(rows, columns=columns)
+            score = sub.get("score")
+            grid[i, j] = np.nan if score is None else score
+        # Gather back out so duplicate enrollments/assignment ids each get their own row/column
+        scores_df = pd.DataFrame(
+            grid[np.ix_([0] + [row_of[u] for u in user_ids], cols)],
+            columns=[title for _, title in unique_titles],
+        )
+
+        return pd.concat([meta_df, scores_df], axis=1)
 
     # ---------------- Enrollments (preferred student count) ----------------
 
@@ -343,15 +423,15 @@ class CanvasService:
         """
         url = f"{self.base_url}/api/v1/courses/{course_id}/enrollments"
         params = {"per_page": 100, "type[]": "StudentEnrollment", "state[]": "active"}
+        # Stream pages into the id set; the enrollment dicts themselves are never collected
+        user_ids = set()
         try:
-            enrollments = self._get_all(url, params=params)
+            for page in self._iter_pages(url, params=params):
+                user_ids.update(e.get("user_id") for e in page)
         except httpx.HTTPStatusError:
             return None
 
-        if not enrollments:
-            return None
-
-        user_ids = {e.get("user_id") for e in enrollments if e.get("user_id") is not None}
+        user_ids.discard(None)
         return len(user_ids) if user_ids else None
 
     # ---------------- Cleanup ----------------
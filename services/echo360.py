@@ -1,10 +1,14 @@
 from __future__ import annotations
 
-from typing import Dict, List, Optional, Callable
+from typing import Dict, List, Callable
 
 import httpx
+import numpy as np
 import pandas as pd
 
+from services.http_cache import ETagCache
+from services.pagination import next_link
+
 
 class Echo360Service:
     """Lightweight client for Echo360 analytics endpoints."""
@@ -17,21 +21,14 @@ class Echo360Service:
                 "Accept": "application/json",
             },
             timeout=timeout,
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=16, keepalive_expiry=60),
         )
+        # Revalidates repeat GETs with If-None-Match (e.g. after "Refresh data")
+        self.etag_cache = ETagCache()
 
     # ---------------- Internal helpers ----------------
 
-    @staticmethod
-    def _next_link(link_header: Optional[str]) -> Optional[str]:
-        if not link_header:
-            return None
-        for part in link_header.split(","):
-            seg = part.strip()
-            if "rel=\"next\"" in seg.lower():
-                url_part = seg.split(";")[0].strip()
-                return url_part.strip("<>")
-        return None
-
     @staticmethod
     def _extract_items(payload) -> List[Dict]:
         if payload is None:
@@ -46,16 +43,39 @@ class Echo360Service:
             return [payload]
         return []
 
+    @staticmethod
+    def _first_truthy(flat: pd.DataFrame, aliases: List[str]) -> np.ndarray:
+        """
+        Column-wise `a or b or c` over flattened alias columns: the first truthy value per
+        row, else the last alias's own value (None when that key is missing).
+        """
+        if not aliases:
+            return np.full(len(flat), None, dtype=object)
+        block = flat.reindex(columns=aliases).to_numpy(dtype=object, copy=True)
+        present = pd.notna(block)
+        block[~present] = None
+        truthy = present & (block != 0) & (block != "")
+        rows = np.arange(len(block))
+        return np.where(truthy.any(axis=1), block[rows, truthy.argmax(axis=1)], block[:, -1])
+
+    @classmethod
+    def _frame_from_records(cls, records: List[Dict], columns: Dict[str, List[str]]) -> pd.DataFrame:
+        """Flatten records once with json_normalize, then resolve each output column from its aliases."""
+        flat = pd.json_normalize([rec for rec in records if isinstance(rec, dict)], sep=".")
+        return pd.DataFrame(
+            {col: cls._first_truthy(flat, aliases) for col, aliases in columns.items()},
+            columns=list(columns),
+        ).infer_objects()
+
     def _get_all(self, url: str, params: Dict | None = None) -> List[Dict]:
         out: List[Dict] = []
+        extend, extract = out.extend, self._extract_items
         next_url = url
         next_params = params or {}
         while next_url:
-            resp = self.client.get(next_url, params=next_params)
-            resp.raise_for_status()
-            items = self._extract_items(resp.json())
-            out.extend(items)
-            next_url = self._next_link(resp.headers.get("Link"))
+            data, link = self.etag_cache.get_json(self.client, next_url, params=next_params)
+            extend(extract(data))
+            next_url = next_link(link)
             next_params = None
         return out
 
@@ -89,50 +109,15 @@ class Echo360Service:
         except httpx.HTTPStatusError:
             viewer_records = []
 
-        rows: List[Dict[str, object]] = []
-        for rec in viewer_records:
-            if not isinstance(rec, dict):
-                continue
-            media = rec.get("media") if isinstance(rec, dict) else None
-            viewer = rec.get("viewer") if isinstance(rec, dict) else None
-            rows.append(
-                {
-                    "Media Title": (
-                        (media or {}).get("title")
-                        or (media or {}).get("name")
-                        or rec.get("mediaTitle")
-                        or rec.get("media_name")
-                        or rec.get("title")
-                    ),
-                    "Video Duration": (
-                        (media or {}).get("durationSeconds")
-                        or rec.get("durationSeconds")
-                        or rec.get("mediaDuration")
-                        or rec.get("duration")
-                    ),
-                    "Total View Time": (
-                        rec.get("viewSeconds")
-                        or rec.get("viewTimeSeconds")
-                        or rec.get("totalViewSeconds")
-                        or rec.get("viewTime")
-                    ),
-                    "Average View Time": (
-                        rec.get("averageViewSeconds")
-                        or rec.get("avgViewSeconds")
-                        or rec.get("averageViewTimeSeconds")
-                        or rec.get("averageViewTime")
-                        or rec.get("viewSeconds")
-                    ),
-                    "User Email": (
-                        (viewer or {}).get("email")
-                        or (viewer or {}).get("username")
-                        or rec.get("viewerEmail")
-                        or rec.get("viewer")
-                    ),
-                }
-            )
-
-        df = pd.DataFrame(rows)
+        df = self._frame_from_records(viewer_records, {
+            "Media Title": ["media.title", "media.name", "mediaTitle", "media_name", "title"],
+            "Video Duration": ["media.durationSeconds", "durationSeconds", "mediaDuration", "duration"],
+            "Total View Time": ["viewSeconds", "viewTimeSeconds", "totalViewSeconds", "viewTime"],
+            "Average View Time": [
+                "averageViewSeconds", "avgViewSeconds", "averageViewTimeSeconds", "averageViewTime", "viewSeconds",
+            ],
+            "User Email": ["viewer.email", "viewer.username", "viewerEmail", "viewer"],
+        })
         if not df.empty:
             return df
 
@@ -141,44 +126,15 @@ class Echo360Service:
         except httpx.HTTPStatusError:
             media_records = []
 
-        agg_rows: List[Dict[str, object]] = []
-        for rec in media_records:
-            if not isinstance(rec, dict):
-                continue
-            media = rec.get("media") if isinstance(rec, dict) else None
-            analytics = rec.get("analytics") if isinstance(rec, dict) else None
-            agg_rows.append(
-                {
-                    "Media Title": (
-                        (media or {}).get("title")
-                        or (media or {}).get("name")
-                        or rec.get("title")
-                    ),
-                    "Video Duration": (
-                        (media or {}).get("durationSeconds")
-                        or rec.get("durationSeconds")
-                        or (analytics or {}).get("durationSeconds")
-                        or rec.get("mediaDuration")
-                    ),
-                    "Total View Time": (
-                        rec.get("totalViewSeconds")
-                        or (analytics or {}).get("totalViewSeconds")
-                    ),
-                    "Average View Time": (
-                        rec.get("averageViewSeconds")
-                        or (analytics or {}).get("averageViewSeconds")
-                    ),
-                    "User Email": None,
-                }
-            )
-
-        return pd.DataFrame(agg_rows, columns=[
-            "Media Title",
-            "Video Duration",
-            "Total View Time",
-            "Average View Time",
-            "User Email",
-        ])
+        return self._frame_from_records(media_records, {
+            "Media Title": ["media.title", "media.name", "title"],
+            "Video Duration": [
+                "media.durationSeconds", "durationSeconds", "analytics.durationSeconds", "mediaDuration",
+            ],
+            "Total View Time": ["totalViewSeconds", "analytics.totalViewSeconds"],
+            "Average View Time": ["averageViewSeconds", "analytics.averageViewSeconds"],
+            "User Email": [],
+        })
 
     # ---------------- Cleanup ----------------
 
@@ -0,0 +1,60 @@
+# services/http_cache.py
+from __future__ import annotations
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+import orjson
+
+
+class ETagCache:
+    """
+    In-memory conditional-GET cache for a single API client.
+
+    Responses that carry an ETag are remembered (decoded JSON + Link header);
+    the next GET of the same URL sends If-None-Match, and a 304 is answered
+    from memory instead of re-downloading the payload. Entries live only in
+    the owning service instance (one per token), so nothing is written to
+    disk and no data is shared between users. Thread-safe.
+    """
+
+    def __init__(self, max_entries: int = 512) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[str, Any, Optional[str]]]" = OrderedDict()
+        self._lock = Lock()
+
+    def get_json(
+        self, client: httpx.Client, url: str, params: Dict | None = None
+    ) -> Tuple[Any, Optional[str]]:
+        """GET `url` and return (decoded JSON, Link header); raises HTTPStatusError like raise_for_status."""
+        request = client.build_request("GET", url, params=params)
+        key = str(request.url)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached:
+                self._entries.move_to_end(key)
+        if cached:
+            request.headers["If-None-Match"] = cached[0]
+
+        r = client.send(request)
+        if r.status_code == 304 and cached:
+            # 304s may omit Link, so pagination uses the stored header
+            return cached[1], cached[2]
+        r.raise_for_status()
+        data = orjson.loads(r.content)
+        link = r.headers.get("Link")
+
+        etag = r.headers.get("ETag")
+        if etag:
+            with self._lock:
+                self._entries[key] = (etag, data, link)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return data, link
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,16 @@
+# services/pagination.py
+from __future__ import annotations
+
+from typing import Optional
+import re
+
+# One <url>; ...rel="next" entry of an RFC 8288 Link header ([^<] keeps the match inside one entry)
+_NEXT_LINK_RE = re.compile(r'<([^>]*)>[^<]*?rel="next"', re.I)
+
+
+def next_link(link_header: Optional[str]) -> Optional[str]:
+    """Return the rel="next" URL from a Link header, or None on the last page."""
+    if not link_header:
+        return None
+    m = _NEXT_LINK_RE.search(link_header)
+    return m.group(1).strip() if m else None
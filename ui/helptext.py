@@ -10,6 +10,7 @@ section in the INI file mirrors the attributes exposed on :class:`HELP`.
 from __future__ import annotations
 
 from configparser import ConfigParser
+from functools import cache
 from pathlib import Path
 from typing import Mapping
 
@@ -62,6 +63,7 @@ _DEFAULT_AI = {
 }
 
 
+@cache
 def _read_config() -> ConfigParser:
     parser = ConfigParser(
         interpolation=None,
@@ -84,49 +86,71 @@ def _merge_section(parser: ConfigParser, section: str, defaults: Mapping[str, st
     return values
 
 
-_parser = _read_config()
-_kpi = _merge_section(_parser, "KPI", _DEFAULT_KPI)
-_echo_summary = _merge_section(_parser, "ECHO_SUMMARY_COLUMNS", _DEFAULT_ECHO_SUMMARY_COLUMNS)
-_echo_module = _merge_section(_parser, "ECHO_MODULE_COLUMNS", _DEFAULT_ECHO_MODULE_COLUMNS)
-_gradebook = _merge_section(_parser, "GRADEBOOK", _DEFAULT_GRADEBOOK)
-_gradebook_module = _merge_section(_parser, "GRADEBOOK_MODULE_COLUMNS", _DEFAULT_GRADEBOOK_MODULE_COLUMNS)
-_charts = _merge_section(_parser, "CHARTS", _DEFAULT_CHARTS)
-_ai = _merge_section(_parser, "AI", _DEFAULT_AI)
-
+_SECTION_DEFAULTS: dict[str, Mapping[str, str]] = {
+    "KPI": _DEFAULT_KPI,
+    "ECHO_SUMMARY_COLUMNS": _DEFAULT_ECHO_SUMMARY_COLUMNS,
+    "ECHO_MODULE_COLUMNS": _DEFAULT_ECHO_MODULE_COLUMNS,
+    "GRADEBOOK": _DEFAULT_GRADEBOOK,
+    "GRADEBOOK_MODULE_COLUMNS": _DEFAULT_GRADEBOOK_MODULE_COLUMNS,
+    "CHARTS": _DEFAULT_CHARTS,
+    "AI": _DEFAULT_AI,
+}
 
-class HELP:
-    """Central place to edit dashboard help copy.
 
-    To change any tooltip, edit ``helptext_content.ini`` next to this file. Each
-    attribute below corresponds to a key in that INI document. Restart the
-    Streamlit app (or clear cached resources) after saving changes to reload the
-    updated text.
-    """
+@cache
+def _section(name: str) -> dict[str, str]:
+    """Merged section values; the INI is parsed on first use, then memoized."""
+    return _merge_section(_read_config(), name, _SECTION_DEFAULTS[name])
 
-    DEFAULT: str | None = None
 
+# HELP attribute -> (INI section, key); a key of None exposes the whole section mapping
+_HELP_ATTRS: dict[str, tuple[str, str | None]] = {
     # KPI tooltips
-    KPI_STUDENTS = _kpi["KPI_STUDENTS"]
-    KPI_AVG_GRADE = _kpi["KPI_AVG_GRADE"]
-    KPI_MEDIAN_LETTER = _kpi["KPI_MEDIAN_LETTER"]
-    KPI_ECHO_ENGAGEMENT = _kpi["KPI_ECHO_ENGAGEMENT"]
-    KPI_FS = _kpi["KPI_FS"]
-    KPI_ASSIGNMENT_AVG = _kpi["KPI_ASSIGNMENT_AVG"]
-
+    "KPI_STUDENTS": ("KPI", "KPI_STUDENTS"),
+    "KPI_AVG_GRADE": ("KPI", "KPI_AVG_GRADE"),
+    "KPI_MEDIAN_LETTER": ("KPI", "KPI_MEDIAN_LETTER"),
+    "KPI_ECHO_ENGAGEMENT": ("KPI", "KPI_ECHO_ENGAGEMENT"),
+    "KPI_FS": ("KPI", "KPI_FS"),
+    "KPI_ASSIGNMENT_AVG": ("KPI", "KPI_ASSIGNMENT_AVG"),
     # Echo tables
-    ECHO_SUMMARY_COLUMNS = _echo_summary
-    ECHO_MODULE_COLUMNS = _echo_module
-
+    "ECHO_SUMMARY_COLUMNS": ("ECHO_SUMMARY_COLUMNS", None),
+    "ECHO_MODULE_COLUMNS": ("ECHO_MODULE_COLUMNS", None),
     # Gradebook tables
-    GRADEBOOK_SUMMARY_DEFAULT = _gradebook["GRADEBOOK_SUMMARY_DEFAULT"]
-    GRADEBOOK_MODULE_COLUMNS = _gradebook_module
-
+    "GRADEBOOK_SUMMARY_DEFAULT": ("GRADEBOOK", "GRADEBOOK_SUMMARY_DEFAULT"),
+    "GRADEBOOK_MODULE_COLUMNS": ("GRADEBOOK_MODULE_COLUMNS", None),
     # Charts
-    CHART_ECHO = _charts["CHART_ECHO"]
-    CHART_GB = _charts["CHART_GB"]
-
+    "CHART_ECHO": ("CHARTS", "CHART_ECHO"),
+    "CHART_GB": ("CHARTS", "CHART_GB"),
     # AI tab
-    AI_ANALYSIS = _ai["AI_ANALYSIS"]
+    "AI_ANALYSIS": ("AI", "AI_ANALYSIS"),
+}
+
+
+class _LazyHelp(type):
+    """Resolve HELP attributes from the INI on first access instead of at import."""
+
+    def __getattr__(cls, name: str):
+        try:
+            section, key = _HELP_ATTRS[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        values = _section(section)
+        return values if key is None else values[key]
+
+    def __dir__(cls):
+        return [*super().__dir__(), *_HELP_ATTRS]
+
+
+class HELP(metaclass=_LazyHelp):
+    """Central place to edit dashboard help copy.
+
+    To change any tooltip, edit ``helptext_content.ini`` next to this file. Each
+    attribute (see ``_HELP_ATTRS``) corresponds to a key in that INI document.
+    The file is read the first time any attribute is used; restart the Streamlit
+    app after saving changes to reload the updated text.
+    """
+
+    DEFAULT: str | None = None
 
 
 __all__ = ["HELP"]